@@ -1,10 +1,85 @@
 import os
+import time
+import threading
+from collections import OrderedDict
 
 import streamlit as st
 from sqlalchemy import Engine, create_engine, text
 import pandas as pd
 from dotenv import load_dotenv
 
+from jobs_common.queries import UPDATE_VIEWED_QUERY, build_filters, count_query, order_by, page_query
+from jobs_common.schema import migrate
+from jobs_common.state import crawl_version
+
+# Seconds query results are reused before fetching them again
+CACHE_TTL = 300
+# Query results kept at most, the least recently used are dropped first
+CACHE_SIZE = 256
+
+
+class QueryCache:
+    """
+    Query results shared by every session, keyed on the filter parameters.
+    Entries expire after `ttl` seconds or as soon as a crawl finishes, and only the `max_size` most
+    recently used are kept. Results are shared as is, they are never modified once cached.
+    """
+
+    def __init__(self, ttl: float, max_size: int):
+        self.ttl = ttl
+        self.max_size = max_size
+        self.entries = OrderedDict()  # key -> (fetched at, crawl version, result), least recently used first
+        self.lock = threading.Lock()
+
+    def get(self, key: tuple, loader):
+        """Cached result for the key, calling `loader` to fetch it if missing or expired"""
+        version = crawl_version()
+        with self.lock:
+            self.evict_stale(version)
+            entry = self.entries.get(key)
+            if entry:
+                self.entries.move_to_end(key)
+                return entry[2]
+
+        result = loader()
+        with self.lock:
+            self.entries[key] = (time.monotonic(), version, result)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+        return result
+
+    def evict_stale(self, version) -> None:
+        """Drop the entries expired or fetched before the last crawl"""
+        now = time.monotonic()
+        for key, (fetched_at, entry_version, _) in list(self.entries.items()):
+            if entry_version != version or now - fetched_at >= self.ttl:
+                del self.entries[key]
+
+    def patch_viewed(self, changes: dict[int, bool]) -> None:
+        """
+        Apply `viewed` changes to the cached pages, replacing them with patched copies.
+        Results filtering out viewed offers can't be patched, they are dropped.
+        """
+        with self.lock:
+            for key, (fetched_at, version, result) in list(self.entries.items()):
+                hide_viewed = key[1]
+                if hide_viewed:
+                    del self.entries[key]
+                elif isinstance(result, pd.DataFrame):
+                    changed = result["id"].isin(changes.keys())
+                    if not changed.any():
+                        continue
+                    # Other sessions may be reading the cached page
+                    patched = result.copy()
+                    patched.loc[changed, "viewed"] = patched.loc[changed, "id"].map(changes)
+                    self.entries[key] = (fetched_at, version, patched)
+
+
+@st.cache_resource
+def get_cache() -> QueryCache:
+    return QueryCache(CACHE_TTL, CACHE_SIZE)
+
 
 class App:
     """Streamlit Jobs Hunting app"""
@@ -23,34 +98,39 @@ class App:
             "Keywords to exclude in Role",
             help=r"Many keywords can be inserted separated by commas. Leading and trailing spaces will be removed. The filter is case insensitive.",
         )
-        # Strip any leading/trailing whitespace from keywords
-        self.inc_words = [w.strip() for w in inc_words.split(",")]
-        self.exc_words = [w.strip() for w in exc_words.split(",")]
+        # Strip any leading/trailing whitespace from keywords, ignoring empty ones
+        self.inc_words = [w.strip() for w in inc_words.split(",") if w.strip()]
+        self.exc_words = [w.strip() for w in exc_words.split(",") if w.strip()]
 
-        # Setup database
-        self.engine = self.setup_db()
+        self.full_text = st.sidebar.toggle(
+            "Full-text search",
+            help=r"Match keywords as word prefixes in Role, Company and Location, ranking offers by relevance. The words of a keyword must all match.",
+        )
 
-        # Fetch all data
-        self.df = self.fetch_data()
+        # Hide viewed offers
+        self.hide_viewed = st.sidebar.checkbox("Hide viewed offers.")
+        page_size = st.sidebar.selectbox("Offers per page", [50, 100, 250, 500], index=1)
 
-        # Save a copy of the data
-        self.original_df = self.df.copy()
+        # Setup database
+        self.engine = self.setup_db()
+        self.cache = get_cache()
 
-        # Filter data before displaying it
-        filtered_df = self.filter_data(self.df)
+        # Count the offers matching the filters
+        total, found = self.count_data()
+        pages = max(1, -(-found // page_size))
+        page = st.sidebar.number_input("Page", min_value=1, max_value=pages, step=1)
 
-        # Hide viewed offers
-        hide_viewed_offers = st.sidebar.checkbox("Hide viewed offers.")
-        if hide_viewed_offers:
-            filtered_df = filtered_df.query("viewed == False")
         # Display the number of rows retrieved
         st.sidebar.markdown(
-            f"Found <b>{len(filtered_df)}</b> out of {len(self.original_df)} jobs.",
+            f"Found <b>{found}</b> out of {total} jobs.",
             unsafe_allow_html=True,
         )
 
+        # Fetch only the page displayed, already filtered
+        self.original_df = self.fetch_data(limit=page_size, offset=(page - 1) * page_size)
+
         # Display the filtered data
-        self.display_table(filtered_df)
+        self.display_table(self.original_df)
 
     @st.cache_resource
     def setup_db(_self) -> Engine:
@@ -67,45 +147,69 @@ class App:
         DB_URL = f"postgresql://{PSQL_USER}:{PSQL_PASSWORD}@{PSQL_HOST}:5432/{PSQL_DB}"
 
         # Create engine
-        return create_engine(DB_URL)
+        engine = create_engine(DB_URL)
+
+        # Queries rely on columns and indexes added over time, bring the schema up to date
+        conn = engine.raw_connection()
+        try:
+            with conn.cursor() as cur:
+                migrate(cur)
+            conn.commit()
+        finally:
+            conn.close()
+        return engine
 
-    # Fetch all data
-    def fetch_data(self) -> pd.DataFrame:
-        """Fetch all data from the database"""
-        query = """
-            SELECT *  FROM jobs 
-            WHERE added_at > CURRENT_DATE - INTERVAL '7 day'  -- Keep only the jobs added along the last 7 days
-            ORDER BY added_at DESC, posted_at DESC, id;"""  # Order by ID to ensure order consistency in equal dates
-        return pd.read_sql(query, self.engine)
+    def cache_key(self, *args) -> tuple:
+        """Key of a query result, made of the filter parameters. Viewed filter goes second, see `QueryCache`."""
+        return (
+            args[0],
+            self.hide_viewed,
+            self.full_text,
+            tuple(self.inc_words),
+            tuple(self.exc_words),
+            *args[1:],
+        )
 
-    def filter_data(self, df: pd.DataFrame) -> pd.DataFrame:
-        """Filter the DataFrame based on include and exclude keywords"""
+    def count_data(self) -> tuple[int, int]:
+        """Count the offers of the last 7 days, and the ones matching the filters"""
+        return self.cache.get(self.cache_key("count"), self.query_count)
 
-        # If both fields are empty, return the full dataset
-        if not any(self.inc_words) and not any(self.exc_words):
-            return df
+    def filters(self) -> tuple[str, dict]:
+        """SQL conditions and parameters for the keywords and viewed filters"""
+        return build_filters(self.inc_words, self.exc_words, self.full_text, self.hide_viewed)
 
-        # Apply inclusion filter
-        if any(self.inc_words):
-            df = df[df["title"].str.contains("|".join(self.inc_words), case=False)]
+    def query_count(self) -> tuple[int, int]:
+        conditions, params = self.filters()
+        with self.engine.connect() as conn:
+            total, found = conn.execute(text(count_query(conditions)), params).one()
+        return total, found
 
-        # Apply exclusion filter
-        if any(self.exc_words):
-            df = df[~df["title"].str.contains("|".join(self.exc_words), case=False)]
+    def fetch_data(self, limit: int, offset: int) -> pd.DataFrame:
+        """Fetch a page of the offers matching the filters, with only the displayed columns"""
+        return self.cache.get(
+            self.cache_key("page", limit, offset),
+            lambda: self.query_page(limit, offset),
+        )
 
-        return df
+    def query_page(self, limit: int, offset: int) -> pd.DataFrame:
+        conditions, params = self.filters()
+        query = page_query(conditions, order_by(self.inc_words, self.full_text))
+        return pd.read_sql(
+            text(query), self.engine, params={**params, "limit": limit, "offset": offset}
+        )
 
-    def update_db(self, id: int, viewed: bool) -> None:
-        """Update the `viewed` column in the database for a given ID"""
+    def update_db(self, changes: dict[int, bool]) -> None:
+        """Update the `viewed` column in the database for the given IDs in a single statement"""
         with self.engine.begin() as conn:
             conn.execute(
-                text("UPDATE jobs SET viewed = :status WHERE id = :id"),
-                {"status": viewed, "id": id},
+                text(UPDATE_VIEWED_QUERY),
+                {"ids": list(changes.keys()), "viewed": list(changes.values())},
             )
+        self.cache.patch_viewed(changes)
 
     def style_table(self, df: pd.DataFrame):
         """Style the table. Capitalize column names and color code based on `viewed` column."""
-        df.columns = [c.capitalize() for c in df.columns]
+        df = df.rename(columns=str.capitalize)
         return df.style.apply(
             lambda row: (
                 ["background-color: #EF7171; color: black"] * len(row)
@@ -140,15 +244,15 @@ class App:
             hide_index=True,
         )
 
-        # Compare changes and auto-save only modified rows
-        for _, row in edited_df.iterrows():
-            original_row = self.original_df[self.original_df["id"] == row["Id"]]
-            if (
-                not original_row.empty
-                and row["Viewed"] != original_row.iloc[0]["viewed"]
-            ):
-                self.update_db(row["Id"], row["Viewed"])
-                st.rerun()
+        # Compare changes by ID and auto-save only modified rows, all at once
+        edited = edited_df.set_index("Id")["Viewed"]
+        original = self.original_df.set_index("id")["viewed"].reindex(edited.index)
+        changed = edited[original.notna() & edited.ne(original)]
+        if not changed.empty:
+            self.update_db(
+                {int(id): bool(viewed) for id, viewed in changed.items()}
+            )
+            st.rerun()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,48 @@
+"""
+Compare the Linkedin parsing paths over a saved page of results.
+Usage: python benchmarks/linkedin_parse.py [-n ROUNDS]
+"""
+
+import sys
+import timeit
+import argparse
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path[:0] = [str(ROOT), str(ROOT / "scrapy_crawl")]
+
+from scrapy.http import HtmlResponse
+
+from jobs_crawl.spiders.linkedin_spider import load_offers, parse_offers
+
+FIXTURE = Path(__file__).resolve().parent / "fixtures" / "linkedin_search.html"
+
+
+def fresh_response() -> HtmlResponse:
+    """Response without a cached selector, so parsing the HTML is part of the measure"""
+    return HtmlResponse(
+        url="https://www.linkedin.com/jobs-guest/jobs/api/seeMoreJobPostings/search?start=0",
+        body=FIXTURE.read_bytes(),
+        encoding="utf-8",
+    )
+
+
+def main(rounds: int) -> None:
+    loaded = [dict(item) for item in load_offers(fresh_response())]
+    parsed = parse_offers(fresh_response())
+    if loaded != parsed:
+        sys.exit(f"Parsers disagree:\n{loaded}\n{parsed}")
+    cards = len(parsed)
+
+    responses = [fresh_response() for _ in range(rounds)]
+    for name, parse in (("ItemLoader", load_offers), ("XPath", parse_offers)):
+        it = iter(responses)
+        seconds = timeit.timeit(lambda: parse(next(it)), number=rounds)
+        print(f"{name:>10}: {rounds * cards / seconds:,.0f} cards/s ({seconds / rounds * 1000:.2f} ms per page)")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("-n", "--rounds", type=int, default=500, help="Pages parsed by each path")
+    args = parser.parse_args()
+    main(args.rounds)
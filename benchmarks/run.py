@@ -0,0 +1,345 @@
+"""
+Crawl benchmark: run each spider end to end against the fixtures server and a throwaway PostgreSQL database.
+Reports items/s, requests/s, per item pipeline latency and peak RSS, saved as JSON to compare runs.
+Usage: python benchmarks/run.py [SOURCE ...] [--latency SECONDS] [--rate-429 RATE] [--baseline RESULTS]
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import resource
+import subprocess
+import tempfile
+from datetime import datetime
+from pathlib import Path
+from urllib.parse import urlsplit
+
+BENCHMARKS = Path(__file__).resolve().parent
+ROOT = BENCHMARKS.parent
+RESULTS_DIR = BENCHMARKS / "results"
+
+SCRAPY_SOURCES = {
+    "linkedin": ("linkedin_spider", {"job": "data scientist", "location": "argentina"}),
+    "trabajo": ("trabajo_spider", {"job": "data scientist"}),
+}
+BROWSER_SOURCES = ["glassdoor", "indeed"]
+SOURCES = [*SCRAPY_SOURCES, *BROWSER_SOURCES]
+SITES = {
+    "linkedin": "www.linkedin.com",
+    "trabajo": "ar.trabajo.org",
+    "glassdoor": "www.glassdoor.com.ar",
+    "indeed": "ar.indeed.com",
+}
+
+# Metrics where a higher value is a regression
+LOWER_IS_BETTER = {"pipeline_p50_ms", "pipeline_p99_ms", "peak_rss_mb", "elapsed_s"}
+
+
+def percentile(values: list[float], q: float) -> float | None:
+    """Nearest rank percentile"""
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(int(q / 100 * len(values)), len(values) - 1)]
+
+
+def summary(items: int, latencies: list[float], elapsed: float) -> dict:
+    """Metrics measured by a worker"""
+    p50, p99 = percentile(latencies, 50), percentile(latencies, 99)
+    return {
+        "items": items,
+        "items_per_s": items / elapsed,
+        "pipeline_p50_ms": p50 * 1000 if p50 is not None else None,
+        "pipeline_p99_ms": p99 * 1000 if p99 is not None else None,
+        # Kilobytes on Linux
+        "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        "elapsed_s": elapsed,
+    }
+
+
+class LocalSitesMiddleware:
+    """Send the requests to the fixtures server, keeping the download slot of the original site"""
+
+    def __init__(self, server_url: str):
+        self.server_url = server_url
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        return cls(crawler.settings.get("BENCHMARK_SERVER"))
+
+    def process_request(self, request, spider):
+        if request.url.startswith(self.server_url):
+            return None
+        parts = urlsplit(request.url)
+        meta = {**request.meta, "download_slot": parts.hostname}
+        url = f"{self.server_url}/{parts.netloc}{parts.path}?{parts.query}"
+        return request.replace(url=url, meta=meta)
+
+
+class LatencyPipeline:
+    """First pipeline, timing each item until it leaves the last one (saved or dropped)"""
+
+    def __init__(self):
+        self.started = {}
+        self.latencies = []
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        from scrapy import signals
+
+        pipeline = cls()
+        crawler.signals.connect(pipeline.item_done, signal=signals.item_scraped)
+        crawler.signals.connect(pipeline.item_done, signal=signals.item_dropped)
+        crawler.signals.connect(pipeline.item_done, signal=signals.item_error)
+        crawler.latency_pipeline = pipeline
+        return pipeline
+
+    def process_item(self, item, spider):
+        self.started[id(item)] = time.perf_counter()
+        return item
+
+    def item_done(self, item, **kwargs):
+        started = self.started.pop(id(item), None)
+        if started is not None:
+            self.latencies.append(time.perf_counter() - started)
+
+
+def run_scrapy(source: str, server_url: str, overrides: dict) -> dict:
+    """Crawl a Scrapy source, in the worker process"""
+    sys.path[:0] = [str(ROOT), str(ROOT / "scrapy_crawl"), str(BENCHMARKS)]
+    os.environ.setdefault("SCRAPY_SETTINGS_MODULE", "jobs_crawl.settings")
+    from scrapy.crawler import CrawlerProcess
+    from scrapy.utils.project import get_project_settings
+
+    settings = get_project_settings()
+    settings.set("LOG_LEVEL", "WARNING")
+    settings.set("TELNETCONSOLE_ENABLED", False)
+    settings.set("HTTPCACHE_ENABLED", False)
+    settings.set("BENCHMARK_SERVER", server_url)
+    # Requests are sent to the local server instead of the allowed domains
+    settings.set(
+        "DOWNLOADER_MIDDLEWARES",
+        {
+            **settings.getdict("DOWNLOADER_MIDDLEWARES"),
+            "scrapy.downloadermiddlewares.offsite.OffsiteMiddleware": None,
+            "run.LocalSitesMiddleware": 10,
+        },
+    )
+    settings.set("ITEM_PIPELINES", {**settings.getdict("ITEM_PIPELINES"), "run.LatencyPipeline": 0})
+    for name, value in overrides.items():
+        settings.set(name, value)
+
+    spider, kwargs = SCRAPY_SOURCES[source]
+    process = CrawlerProcess(settings)
+    crawler = process.create_crawler(spider)
+    process.crawl(crawler, **kwargs)
+    start = time.perf_counter()
+    process.start()
+    elapsed = time.perf_counter() - start
+
+    stats = crawler.stats.get_stats()
+    return summary(stats.get("item_scraped_count", 0), crawler.latency_pipeline.latencies, elapsed)
+
+
+async def crawl_browser(source: str, server_url: str, tabs: int) -> dict:
+    import zendriver as zd
+
+    import main
+    import db_model
+    import tab_pool
+    from tab_pool import Source, TabPool
+
+    # Point the source to the local server, and time the offers saved from each page
+    module = sys.modules[main.PAGE_SOURCES[source].scrape_page.__module__]
+    search_url = module.search_url
+    module.search_url = lambda job, page=0: f"{server_url}/{search_url(job, page).split('://', 1)[1]}"
+
+    scraped = 0
+    latencies = []
+    scrape_page, save_offers = main.PAGE_SOURCES[source].scrape_page, tab_pool.save_offers
+
+    async def counted_scrape_page(tab, job, page):
+        nonlocal scraped
+        offers = await scrape_page(tab, job, page)
+        scraped += len(offers)
+        return offers
+
+    async def timed_save_offers(index, offers, source):
+        start = time.perf_counter()
+        result = await save_offers(index, offers, source)
+        latencies.extend([time.perf_counter() - start] * len(offers))
+        return result
+
+    tab_pool.save_offers = timed_save_offers
+    source_config = main.PAGE_SOURCES[source]
+    sources = {source: Source(counted_scrape_page, source_config.domain, source_config.max_pages)}
+
+    browser = await zd.start(headless=True)
+    start = time.perf_counter()
+    await TabPool(browser, sources, tabs_per_site=tabs).run(["data-scientist"], {})
+    await db_model.load_spool()
+    elapsed = time.perf_counter() - start
+    await browser.stop()
+    return summary(scraped, latencies, elapsed)
+
+
+def run_browser(source: str, server_url: str, tabs: int) -> dict:
+    """Crawl a zendriver source through the tab pool, in the worker process"""
+    sys.path[:0] = [str(ROOT / "zendriver_crawl")]
+    import zendriver as zd
+
+    return zd.loop().run_until_complete(crawl_browser(source, server_url, tabs))
+
+
+def worker(args) -> None:
+    if args.worker in SCRAPY_SOURCES:
+        overrides = dict(setting.split("=", 1) for setting in args.setting)
+        result = run_scrapy(args.worker, args.server, overrides)
+    else:
+        result = run_browser(args.worker, args.server, args.tabs)
+    print(json.dumps(result))
+
+
+def admin_connection():
+    """Autocommit connection to the database configured in .env"""
+    import psycopg2
+    from dotenv import load_dotenv
+
+    load_dotenv(ROOT / ".env")
+    conn = psycopg2.connect(
+        user=os.getenv("PSQL_USER"),
+        password=os.getenv("PSQL_PASSWORD"),
+        host=os.getenv("PSQL_HOST"),
+        dbname=os.getenv("PSQL_DB"),
+    )
+    conn.autocommit = True
+    return conn
+
+
+def create_database() -> str:
+    """Throwaway database in the PostgreSQL server configured in .env"""
+    name = f"jobs_benchmark_{os.getpid()}"
+    with admin_connection().cursor() as cur:
+        cur.execute(f"CREATE DATABASE {name}")
+        cur.connection.close()
+    return name
+
+
+def drop_database(name: str) -> None:
+    with admin_connection().cursor() as cur:
+        cur.execute(f"DROP DATABASE IF EXISTS {name}")
+        cur.connection.close()
+
+
+def run_source(source: str, server, database: str, args) -> dict:
+    """Run a source in its own process, with an empty state folder"""
+    server.reset()
+    with tempfile.TemporaryDirectory() as state_dir:
+        env = {**os.environ, "PSQL_DB": database, "CRAWL_STATE_DIR": state_dir}
+        command = [sys.executable, __file__, "--worker", source, "--server", server.url]
+        command += ["--tabs", str(args.tabs)] + [f"--setting={s}" for s in args.setting]
+        process = subprocess.run(command, env=env, capture_output=True, text=True)
+    if process.returncode:
+        print(process.stderr, file=sys.stderr)
+        return {"error": f"worker exited with {process.returncode}"}
+
+    result = json.loads(process.stdout.strip().splitlines()[-1])
+    counts = server.reset()
+    result["requests"] = counts[f"{SITES[source]}/requests"]
+    result["requests_per_s"] = result["requests"] / result["elapsed_s"]
+    result["responses_429"] = counts[f"{SITES[source]}/429"]
+    return result
+
+
+def commit() -> str | None:
+    process = subprocess.run(
+        ["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True, text=True
+    )
+    return process.stdout.strip() or None
+
+
+def compare(results: dict, baseline: dict, threshold: float) -> bool:
+    """Print the change of every metric against a previous run, returns False on regressions"""
+    ok = True
+    for source, metrics in results["sources"].items():
+        previous = baseline["sources"].get(source, {})
+        for name, value in metrics.items():
+            old = previous.get(name)
+            if not isinstance(value, (int, float)) or not old:
+                continue
+            change = (value - old) / old
+            worse = change > threshold if name in LOWER_IS_BETTER else change < -threshold
+            if name.endswith("_per_s") or name in LOWER_IS_BETTER:
+                ok &= not worse
+            flag = "  REGRESSION" if worse else ""
+            print(f"{source:>10} {name:<16} {old:>12.2f} -> {value:>12.2f} ({change:+.1%}){flag}")
+    return ok
+
+
+def main(args) -> None:
+    from server import start_server
+
+    server = start_server(latency=args.latency, rate_429=args.rate_429, pages=args.pages)
+    database = create_database()
+    results = {
+        "started_at": datetime.now().isoformat(timespec="seconds"),
+        "commit": commit(),
+        "config": {
+            "latency": args.latency,
+            "rate_429": args.rate_429,
+            "pages": args.pages,
+            "tabs": args.tabs,
+            "settings": args.setting,
+        },
+        "sources": {},
+    }
+    try:
+        for source in args.sources:
+            print(f"Running {source}...")
+            results["sources"][source] = run_source(source, server, database, args)
+            print(json.dumps(results["sources"][source], indent=2))
+    finally:
+        drop_database(database)
+        server.shutdown()
+
+    output = args.output or RESULTS_DIR / f"{datetime.now():%Y%m%d-%H%M%S}-{results['commit']}.json"
+    Path(output).parent.mkdir(parents=True, exist_ok=True)
+    Path(output).write_text(json.dumps(results, indent=2))
+    print(f"Results saved to {output}")
+
+    if args.baseline:
+        baseline = json.loads(Path(args.baseline).read_text())
+        if not compare(results, baseline, args.threshold):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument(
+        "sources", nargs="*", default=SOURCES, help=f"Sources to run: {', '.join(SOURCES)} (default: all)"
+    )
+    parser.add_argument("--latency", type=float, default=0.05, help="Seconds the server waits before answering")
+    parser.add_argument("--rate-429", type=float, default=0, help="Share of requests answered with 429")
+    parser.add_argument("--pages", type=int, default=10, help="Pages of results of every search")
+    parser.add_argument("--tabs", type=int, default=2, help="Tabs per site of the browser sources")
+    parser.add_argument(
+        "-s", "--setting", action="append", default=[], help="Scrapy setting override, as NAME=VALUE"
+    )
+    parser.add_argument("-o", "--output", type=str, help="Results file (default: benchmarks/results/)")
+    parser.add_argument("--baseline", type=str, help="Results of a previous run to compare with")
+    parser.add_argument(
+        "--threshold", type=float, default=0.1, help="Relative change considered a regression"
+    )
+    parser.add_argument("--worker", choices=SOURCES, help=argparse.SUPPRESS)
+    parser.add_argument("--server", type=str, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if unknown := set(args.sources) - set(SOURCES):
+        parser.error(f"unknown sources: {', '.join(unknown)}")
+
+    if args.worker:
+        worker(args)
+    else:
+        main(args)
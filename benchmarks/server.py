@@ -0,0 +1,140 @@
+"""
+Local stand-in for the job sites, replaying the pages in `fixtures`.
+Requests are expected as /<site host>/<original path>, e.g. /www.linkedin.com/jobs-guest/...
+Usage: python benchmarks/server.py [-p PORT] [--latency SECONDS] [--rate-429 RATE] [--pages N]
+"""
+
+import re
+import json
+import time
+import random
+import argparse
+import threading
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from urllib.parse import parse_qs, urlsplit
+
+FIXTURES = Path(__file__).resolve().parent / "fixtures"
+
+# Site host -> fixture, and how the page number is read from a request
+SITES = {
+    "www.linkedin.com": "linkedin_search.html",
+    "ar.trabajo.org": "trabajo_search.html",
+    "www.glassdoor.com.ar": "glassdoor_search.html",
+    "ar.indeed.com": "indeed_search.html",
+}
+GLASSDOOR_PAGE = re.compile(r"_IP(\d+)\.htm$")
+
+
+def page_number(host: str, path: str, query: dict) -> int:
+    """Page of results requested, from 0"""
+    if host == "www.glassdoor.com.ar":
+        match = GLASSDOOR_PAGE.search(path)
+        return int(match.group(1)) - 1 if match else 0
+    # Linkedin and Indeed use the offset of the first offer
+    start = query.get("start", ["0"])[0]
+    return int(start) // 10 if start.isdigit() else 0
+
+
+class FixtureServer(ThreadingHTTPServer):
+    """
+    Serves `pages` pages of results of every site, the offers of each page are made unique by their title.
+    Past the last page Linkedin answers empty pages, and the other sites repeat the last one.
+    Each response is delayed `latency` seconds, and `rate_429` of them are 429 with a `Retry-After` header.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, address, latency: float = 0, rate_429: float = 0, pages: int = 10, seed: int = 0):
+        super().__init__(address, FixtureHandler)
+        self.latency = latency
+        self.rate_429 = rate_429
+        self.pages = pages
+        self.random = random.Random(seed)
+        self.fixtures = {host: (FIXTURES / name).read_text() for host, name in SITES.items()}
+        self.lock = threading.Lock()
+        self.counts = Counter()
+
+    @property
+    def url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def count(self, key: str) -> None:
+        with self.lock:
+            self.counts[key] += 1
+
+    def reset(self) -> Counter:
+        """Counters since the last reset"""
+        with self.lock:
+            counts, self.counts = self.counts, Counter()
+        return counts
+
+    def throttled(self) -> bool:
+        with self.lock:
+            return self.random.random() < self.rate_429
+
+
+class FixtureHandler(BaseHTTPRequestHandler):
+    server: FixtureServer
+
+    def do_GET(self):
+        parts = urlsplit(self.path)
+        host, _, path = parts.path.lstrip("/").partition("/")
+        if host not in SITES:
+            self.send_error(404)
+            return
+        self.server.count(f"{host}/requests")
+        time.sleep(self.server.latency)
+
+        if self.server.throttled():
+            self.server.count(f"{host}/429")
+            self.send_response(429)
+            self.send_header("Retry-After", "1")
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+
+        page = page_number(host, path, parse_qs(parts.query))
+        if page >= self.server.pages:
+            if host == "www.linkedin.com":
+                self.send_body(b"")
+                return
+            page = self.server.pages - 1
+        self.send_body(self.server.fixtures[host].replace("__PAGE__", str(page)).encode())
+
+    def send_body(self, body: bytes) -> None:
+        self.send_response(200)
+        self.send_header("Content-Type", "text/html; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_server(port: int = 0, **kwargs) -> FixtureServer:
+    """Start the server in a background thread, on a free port by default"""
+    server = FixtureServer(("127.0.0.1", port), **kwargs)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("-p", "--port", type=int, default=8765, help="Port to listen on")
+    parser.add_argument("--latency", type=float, default=0, help="Seconds to wait before answering")
+    parser.add_argument("--rate-429", type=float, default=0, help="Share of requests answered with 429")
+    parser.add_argument("--pages", type=int, default=10, help="Pages of results of every search")
+    args = parser.parse_args()
+
+    server = FixtureServer(
+        ("127.0.0.1", args.port), latency=args.latency, rate_429=args.rate_429, pages=args.pages
+    )
+    print(f"Serving {', '.join(SITES)} at {server.url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print(json.dumps(server.reset(), indent=2))
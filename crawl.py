@@ -0,0 +1,160 @@
+import os
+import sys
+import time
+import asyncio
+import argparse
+from pathlib import Path
+
+# Make both crawlers importable
+ROOT = Path(__file__).resolve().parent
+sys.path[:0] = [str(ROOT / "scrapy_crawl"), str(ROOT / "zendriver_crawl")]
+os.environ.setdefault("SCRAPY_SETTINGS_MODULE", "jobs_crawl.settings")
+
+from scrapy.crawler import CrawlerProcess
+from scrapy.utils.defer import deferred_from_coro
+from scrapy.utils.project import get_project_settings
+
+from utils import logging, timed
+from main import start_browser, spider_runs
+from db_model import load_spool
+from jobs_common.dedup import load_index
+from jobs_common.metrics import write_metrics
+from jobs_common.retention import run_retention
+from jobs_common.state import mark_crawl_finished
+
+
+async def crawl_spider(process: CrawlerProcess, name: str, **kwargs) -> None:
+    """Run a Scrapy spider, it only starts once awaited"""
+    await process.crawl(name, **kwargs).asFuture(asyncio.get_running_loop())
+
+
+async def crawl_all(
+    process: CrawlerProcess,
+    jobs: list[str],
+    locations: list[str],
+    concurrency: int,
+    tabs: int,
+    max_per_domain: int,
+    timings: dict,
+) -> None:
+    """Run every source for every job search (and location in Linkedin), at most `concurrency` at a time"""
+    semaphore = asyncio.Semaphore(concurrency)
+    try:
+        browser = await start_browser()
+    except Exception:
+        # Scrapy sources don't need it, they still run
+        logging.exception("Couldn't start the browser, skipping the browser sources.")
+        browser = None
+
+    crawls = spider_runs(browser, jobs, timings, semaphore, tabs, max_per_domain) if browser else []
+    for job in jobs:
+        crawls.append(
+            timed(
+                f"trabajo_spider ({job})",
+                crawl_spider(process, "trabajo_spider", job=job),
+                timings,
+                semaphore,
+            )
+        )
+        for location in locations:
+            crawls.append(
+                timed(
+                    f"linkedin_spider ({job}, {location})",
+                    crawl_spider(process, "linkedin_spider", job=job, location=location),
+                    timings,
+                    semaphore,
+                )
+            )
+    try:
+        await asyncio.gather(*crawls)
+    finally:
+        # Whatever happened, keep what was scraped
+        if browser is not None:
+            try:
+                await browser.stop()
+            except Exception:
+                logging.exception("Couldn't stop the browser.")
+        # Share the offers saved with the next runs and the other crawlers
+        load_index().save()
+        # Scrapy spiders load the spool as they finish, take what's left
+        await load_spool()
+        # Once a day, archive the offers no longer published
+        await asyncio.to_thread(run_retention)
+        mark_crawl_finished()
+        write_metrics("crawl")
+
+
+def run(
+    jobs: list[str], locations: list[str], concurrency: int, tabs: int = 0, max_per_domain: int = 2
+) -> dict:
+    """Run the Scrapy and zendriver spiders concurrently on the same asyncio loop"""
+    # Logging is already set up by the zendriver crawler
+    settings = get_project_settings()
+    # Scrapy and zendriver metrics are kept together, in a single file
+    settings.set("METRICS_NAME", "crawl")
+    process = CrawlerProcess(settings, install_root_handler=False)
+    # The reactor is installed by the process, import it afterwards
+    from twisted.internet import reactor
+
+    timings = {}
+    failures = []
+
+    def crawl_failed(failure) -> None:
+        logging.error(f"Crawl failed: {failure.getTraceback()}")
+        failures.append(failure)
+
+    d = deferred_from_coro(crawl_all(process, jobs, locations, concurrency, tabs, max_per_domain, timings))
+    d.addErrback(crawl_failed)
+    d.addBoth(lambda _: reactor.stop())
+
+    process.start(stop_after_crawl=False)
+    # Let schedulers know the crawl didn't complete
+    if failures:
+        sys.exit(1)
+    return timings
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Run all the spiders in a single process. Location is set to Argentina, except in Linkedin."
+    )
+    parser.add_argument(
+        "-s", "--search", type=str, nargs="+", required=True, help="Job search keywords"
+    )
+    parser.add_argument(
+        "-l",
+        "--location",
+        type=str,
+        nargs="+",
+        default=["argentina"],
+        help="Locations to look for jobs in Linkedin",
+    )
+    parser.add_argument(
+        "-c",
+        "--concurrency",
+        type=int,
+        default=4,
+        help="Max number of spiders running at the same time (keep it below PSQL_POOL_SIZE)",
+    )
+    parser.add_argument(
+        "-t",
+        "--tabs",
+        type=int,
+        default=0,
+        help="Tabs per site scraping the browser sources in parallel (0 runs one spider per search)",
+    )
+    parser.add_argument(
+        "-p",
+        "--per-domain",
+        type=int,
+        default=2,
+        help="Max number of pages of the same browser source loading at the same time",
+    )
+    args = parser.parse_args()
+
+    logging.info(f"Looking for {', '.join(args.search)}.")
+    start = time.perf_counter()
+    timings = run(args.search, args.location, args.concurrency, args.tabs, args.per_domain)
+    for name, seconds in sorted(timings.items(), key=lambda t: t[1], reverse=True):
+        logging.info(f"{name} took {seconds:.1f}s.")
+    logging.info(f"Crawl finished in {time.perf_counter() - start:.1f}s.")
@@ -0,0 +1,95 @@
+import re
+from datetime import date, datetime
+from functools import lru_cache
+
+from dateutil.relativedelta import relativedelta
+
+# Every relative date of the run is computed from the same moment
+RUN_STARTED = datetime.now()
+
+ISO_DATE = re.compile(r"\d{4}-\d{2}-\d{2}")
+# A quantity, as digits ("30+ d", "5h") or an article ("un mes", "an hour"), followed by a unit
+RELATIVE = re.compile(r"(?:(\d+)|\b(una?|an?)\b)\s*\+?\s*([^\W\d_]+)")
+# Dates given without a quantity, in days ago
+KEYWORDS = {
+    "just": 0,
+    "today": 0,
+    "hoy": 0,
+    "ahora": 0,
+    "recién": 0,
+    "recien": 0,
+    "yesterday": 1,
+    "ayer": 1,
+}
+
+# Unit names (singular, spanish and english) and abbreviations as `relativedelta` arguments
+UNITS = {
+    "s": "seconds",
+    "seg": "seconds",
+    "segundo": "seconds",
+    "second": "seconds",
+    "m": "minutes",
+    "min": "minutes",
+    "minuto": "minutes",
+    "minute": "minutes",
+    "h": "hours",
+    "hs": "hours",
+    "hora": "hours",
+    "hour": "hours",
+    "d": "days",
+    "día": "days",
+    "dia": "days",
+    "day": "days",
+    "w": "weeks",
+    "sem": "weeks",
+    "semana": "weeks",
+    "week": "weeks",
+    "mo": "months",
+    "mes": "months",
+    "month": "months",
+    "año": "years",
+    "ano": "years",
+    "year": "years",
+}
+
+
+def unit_name(word: str) -> str | None:
+    """`relativedelta` argument of a unit, in singular or plural"""
+    for singular in (word, word.removesuffix("es"), word.removesuffix("s")):
+        if singular in UNITS:
+            return UNITS[singular]
+    return None
+
+
+@lru_cache(maxsize=4096)
+def parse_date(text: str, now: datetime) -> date | None:
+    text = text.strip().casefold()
+    if ISO_DATE.fullmatch(text):
+        return date.fromisoformat(text)
+
+    for match in RELATIVE.finditer(text):
+        digits, article, word = match.groups()
+        unit = unit_name(word)
+        if unit:
+            return (now - relativedelta(**{unit: int(digits) if digits else 1})).date()
+
+    for keyword, days in KEYWORDS.items():
+        if keyword in text:
+            return (now - relativedelta(days=days)).date()
+    return None
+
+
+def to_date(text: str | None, now: datetime = RUN_STARTED) -> date | None:
+    """
+    Date of an ISO formatted ("2024-05-30") or relative ("30+ d", "hace 1 mes", "3 days ago", "Just posted") string.
+    Returns None for unknown formats.
+    """
+    if not text:
+        return None
+    return parse_date(text, now)
+
+
+def to_dates(texts: list[str | None], now: datetime = RUN_STARTED) -> list[date | None]:
+    """Dates of a page of strings, parsing each distinct string once"""
+    dates = {text: to_date(text, now) for text in set(texts)}
+    return [dates[text] for text in texts]
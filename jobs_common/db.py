@@ -0,0 +1,82 @@
+import os
+import threading
+from contextlib import contextmanager
+
+from psycopg2.extras import execute_values
+from psycopg2.pool import ThreadedConnectionPool
+from dotenv import load_dotenv
+
+_pool = None
+_pool_lock = threading.Lock()
+
+# `xmax` is 0 for rows just inserted, and the id of the updating transaction otherwise
+UPSERT_QUERY = """
+    INSERT INTO jobs(title, company, location, posted_at, url) 
+    VALUES %s
+    ON CONFLICT (title, company, location) 
+    DO UPDATE SET 
+        added_at = CURRENT_DATE,
+        url = EXCLUDED.url
+    RETURNING (xmax = 0) AS inserted;
+    """
+
+
+def get_pool() -> ThreadedConnectionPool:
+    """Connection pool shared by every crawler running in the process"""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = create_pool()
+    return _pool
+
+
+def create_pool() -> ThreadedConnectionPool:
+    load_dotenv()
+
+    # Database URL
+    PSQL_CONFIG = {
+        "user": os.getenv("PSQL_USER"),
+        "password": os.getenv("PSQL_PASSWORD"),
+        "host": os.getenv("PSQL_HOST"),
+        "dbname": os.getenv("PSQL_DB"),
+    }
+
+    # Connect to my database
+    return ThreadedConnectionPool(
+        minconn=1, maxconn=int(os.getenv("PSQL_POOL_SIZE", 10)), **PSQL_CONFIG
+    )
+
+
+def getconn():
+    """Borrow a connection from the pool, it has to be given back with `putconn`"""
+    return get_pool().getconn()
+
+
+def putconn(conn) -> None:
+    """Give a connection back to the pool, lost connections are discarded"""
+    get_pool().putconn(conn, close=bool(conn.closed))
+
+
+@contextmanager
+def connection():
+    """Borrow a connection for a short task, committing it at the end"""
+    conn = getconn()
+    try:
+        with conn:
+            yield conn
+    finally:
+        putconn(conn)
+
+
+def upsert_offers(cur, rows: list[tuple]) -> tuple[int, int]:
+    """
+    Insert or refresh offers given as (title, company, location, posted_at, url) tuples, in a single statement.
+    Returns how many offers were inserted and how many updated.
+    """
+    # A multi-row upsert can't affect the same row twice, keep the last version of each offer
+    rows = list({row[:3]: row for row in rows}.values())
+    if not rows:
+        return 0, 0
+    results = execute_values(cur, UPSERT_QUERY, rows, page_size=len(rows), fetch=True)
+    inserted = sum(r[0] for r in results)
+    return inserted, len(results) - inserted
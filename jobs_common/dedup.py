@@ -0,0 +1,216 @@
+import fcntl
+import struct
+import threading
+import logging
+import hashlib
+from array import array
+from bisect import bisect_left
+from datetime import date
+from pathlib import Path
+
+import psycopg2
+
+from jobs_common.db import connection
+from jobs_common.state import STATE_DIR, replacing
+
+INDEX_PATH = STATE_DIR / "offers.idx"
+
+# Offers saved by any spider in the last days are dropped before reaching the database.
+# Keep it below the 7 days shown by the app, as saving refreshes `added_at`
+DEDUP_MAX_AGE_DAYS = 3
+
+# File header: magic bytes and number of offers
+HEADER = struct.Struct("<4sQ")
+MAGIC = b"JOB1"
+
+
+def normalize(value) -> str:
+    """Lowercase the value and collapse its whitespaces"""
+    return " ".join(str(value or "").split()).casefold()
+
+
+def offer_key(title, company, location) -> int:
+    """64 bits hash identifying an offer by its normalized title, company and location"""
+    data = "\x1f".join(normalize(v) for v in (title, company, location)).encode()
+    return int.from_bytes(hashlib.blake2b(data, digest_size=8).digest(), "big")
+
+
+def merge(keys_a: array, days_a: array, keys_b: array, days_b: array):
+    """Merge two sorted sets of keys, keeping the latest day of the keys found in both"""
+    keys, days = array("Q"), array("I")
+    i = j = 0
+    while i < len(keys_a) and j < len(keys_b):
+        if keys_a[i] < keys_b[j]:
+            keys.append(keys_a[i])
+            days.append(days_a[i])
+            i += 1
+        elif keys_a[i] > keys_b[j]:
+            keys.append(keys_b[j])
+            days.append(days_b[j])
+            j += 1
+        else:
+            keys.append(keys_a[i])
+            days.append(max(days_a[i], days_b[j]))
+            i += 1
+            j += 1
+    keys.extend(keys_a[i:])
+    days.extend(days_a[i:])
+    keys.extend(keys_b[j:])
+    days.extend(days_b[j:])
+    return keys, days
+
+
+class DedupIndex:
+    """
+    Offers already stored in the database, shared by every crawler through a file on disk.
+    Each offer takes 12 bytes: its `offer_key` in a sorted array and the day it was last saved in another one.
+    Offers saved during the run are kept apart until `save` merges them into the file.
+    Safe to use from any thread, and to save from several processes at once.
+    """
+
+    def __init__(self, path: Path = INDEX_PATH):
+        self.path = Path(path)
+        self.keys, self.days = array("Q"), array("I")
+        self.added = {}  # Offers saved during the run, key -> day ordinal
+        self.seen = set()  # Offers processed during the run, by any spider
+        self.lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self.keys) + len(self.added)
+
+    def read(self):
+        """Read the keys and days stored on disk"""
+        keys, days = array("Q"), array("I")
+        if not self.path.exists():
+            return keys, days
+        with open(self.path, "rb") as f:
+            magic, size = HEADER.unpack(f.read(HEADER.size))
+            if magic != MAGIC:
+                raise ValueError(f"{self.path} is not an offers index.")
+            keys.fromfile(f, size)
+            days.fromfile(f, size)
+        return keys, days
+
+    def load(self) -> bool:
+        """Load the index from disk, returns False if there is none yet"""
+        if not self.path.exists():
+            return False
+        self.keys, self.days = self.read()
+        return True
+
+    def build(self, cur) -> None:
+        """Build the index from the `jobs` table"""
+        added = {}
+        cur.execute("SELECT title, company, location, added_at FROM jobs")
+        while rows := cur.fetchmany(10_000):
+            for title, company, location, added_at in rows:
+                key = offer_key(title, company, location)
+                added[key] = max(added.get(key, 0), added_at.toordinal())
+        self.keys = array("Q", sorted(added))
+        self.days = array("I", (added[k] for k in self.keys))
+
+    def last_saved(self, key: int) -> int | None:
+        """Day ordinal the offer was last saved"""
+        with self.lock:
+            if key in self.added:
+                return self.added[key]
+            i = bisect_left(self.keys, key)
+            if i < len(self.keys) and self.keys[i] == key:
+                return self.days[i]
+            return None
+
+    def __contains__(self, key: int) -> bool:
+        return self.last_saved(key) is not None
+
+    def is_duplicate(self, key: int) -> bool:
+        """Whether the offer was already processed during this run, marking it as processed"""
+        if key in self.seen:
+            return True
+        self.seen.add(key)
+        return False
+
+    def is_fresh(self, key: int, max_age_days: int) -> bool:
+        """Whether the offer was saved in the last `max_age_days` days"""
+        day = self.last_saved(key)
+        return day is not None and date.today().toordinal() - day <= max_age_days
+
+    def filter_new(self, offers: list[dict], max_age_days: int) -> list[dict]:
+        """Offers that have to be saved, dropping duplicates and the ones saved recently"""
+        new_offers = []
+        for offer in offers:
+            key = offer_key(offer["title"], offer["company"], offer["location"])
+            if not self.is_duplicate(key) and not self.is_fresh(key, max_age_days):
+                new_offers.append(offer)
+        return new_offers
+
+    def forget(self, offers: list[dict]) -> None:
+        """Unmark offers as processed, so they aren't taken as duplicates when processed again"""
+        for offer in offers:
+            self.seen.discard(offer_key(offer["title"], offer["company"], offer["location"]))
+
+    def add(self, offers) -> None:
+        """Record offers as saved today, given as (title, company, location, ...) tuples"""
+        today = date.today().toordinal()
+        keys = [offer_key(*offer[:3]) for offer in offers]
+        with self.lock:
+            for key in keys:
+                self.added[key] = today
+
+    def snapshot(self) -> "DedupIndex":
+        """Copy of the offers stored so far, the ones saved afterwards aren't added to it"""
+        with self.lock:
+            added = array("Q", sorted(self.added))
+            keys, days = merge(self.keys, self.days, added, array("I", (self.added[k] for k in added)))
+        snapshot = DedupIndex(self.path)
+        snapshot.keys, snapshot.days = keys, days
+        return snapshot
+
+    def save(self) -> None:
+        """Merge the offers saved during the run into the file, along with the ones other crawlers saved"""
+        # Offers can't be added while saving, they would be missed by the merge
+        with self.lock:
+            keys, days = self.write()
+            self.keys, self.days, self.added = keys, days, {}
+
+    def write(self):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        # A single process at a time reads, merges and replaces the file, so none loses the others' offers
+        with open(self.path.with_suffix(".lock"), "a") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            keys, days = self.read()
+            keys, days = merge(keys, days, self.keys, self.days)
+            added = array("Q", sorted(self.added))
+            keys, days = merge(keys, days, added, array("I", (self.added[k] for k in added)))
+
+            # Readers never see a partial index
+            with replacing(self.path) as f:
+                f.write(HEADER.pack(MAGIC, len(keys)))
+                keys.tofile(f)
+                days.tofile(f)
+        return keys, days
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def load_index() -> DedupIndex:
+    """Offers index shared by all the spiders in the process, built from the database the first time"""
+    global _index
+    with _index_lock:
+        if _index is None:
+            _index = DedupIndex()
+            if not _index.load():
+                build_index(_index)
+    return _index
+
+
+def build_index(index: DedupIndex) -> None:
+    logging.info("Building offers index from the database.")
+    try:
+        # Server side cursor, rows are streamed instead of loaded at once
+        with connection() as conn, conn.cursor(name="offers_index") as cur:
+            index.build(cur)
+        index.save()
+    except psycopg2.Error as e:
+        logging.warning(f"Couldn't build offers index, starting empty: {e}")
@@ -0,0 +1,124 @@
+import time
+import threading
+from bisect import bisect_left
+from contextlib import contextmanager
+from pathlib import Path
+
+from jobs_common.state import STATE_DIR, replacing
+
+# Files in the Prometheus text format, one per crawling process (e.g. for node_exporter's textfile collector)
+METRICS_DIR = STATE_DIR / "metrics"
+
+# Upper bounds of the histogram buckets, in seconds
+BUCKETS = (0.0005, 0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+def escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def format_labels(labels: dict) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{k}="{escape(v)}"' for k, v in labels.items()) + "}"
+
+
+class Metric:
+    """Series of a metric by label values, safe to update from any thread"""
+
+    kind = None
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple[str, ...]):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self.series = {}
+        self.lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def key(self, labels: dict) -> tuple:
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        with self.lock:
+            for key, value in sorted(self.series.items()):
+                lines.extend(self.render_series(dict(zip(self.labelnames, key)), value))
+        return lines
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = self.key(labels)
+        with self.lock:
+            self.series[key] = self.series.get(key, 0) + amount
+
+    def render_series(self, labels: dict, value) -> list[str]:
+        return [f"{self.name}_total{format_labels(labels)} {value}"]
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def observe(self, value: float, **labels) -> None:
+        key = self.key(labels)
+        with self.lock:
+            # Count per bucket (the last one is +Inf), and sum of the values
+            counts, total = self.series.get(key, ([0] * (len(BUCKETS) + 1), 0))
+            counts[bisect_left(BUCKETS, value)] += 1
+            self.series[key] = (counts, total + value)
+
+    @contextmanager
+    def time(self, **labels):
+        """Observe the seconds taken by the block"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def render_series(self, labels: dict, value) -> list[str]:
+        counts, total = value
+        lines = []
+        cumulative = 0
+        for bound, count in zip((*BUCKETS, "+Inf"), counts):
+            cumulative += count
+            lines.append(f"{self.name}_bucket{format_labels({**labels, 'le': bound})} {cumulative}")
+        lines.append(f"{self.name}_sum{format_labels(labels)} {total}")
+        lines.append(f"{self.name}_count{format_labels(labels)} {cumulative}")
+        return lines
+
+
+REGISTRY = []
+
+STAGE_SECONDS = Histogram(
+    "jobs_stage_seconds", "Time taken by each pipeline stage per item", ("source", "stage")
+)
+SAVE_SECONDS = Histogram(
+    "jobs_save_batch_seconds", "Time taken to save a batch of offers to the database", ("source",)
+)
+PAGE_SECONDS = Histogram(
+    "jobs_page_fetch_seconds", "Time taken to fetch a page of results", ("source",)
+)
+OFFERS = Counter(
+    "jobs_offers",
+    "Offers by outcome: kept or dropped (duplicated or recently saved), then inserted, updated or unsaved",
+    ("source", "outcome"),
+)
+
+
+def render() -> str:
+    """All the metrics in the Prometheus text format"""
+    return "\n".join(line for metric in REGISTRY for line in metric.render()) + "\n"
+
+
+def write_metrics(name: str) -> Path:
+    """Write the metrics of the process to METRICS_DIR/<name>.prom"""
+    path = METRICS_DIR / f"{name}.prom"
+    path.parent.mkdir(parents=True, exist_ok=True)
+    # Collectors never read a partial file
+    with replacing(path, "w") as f:
+        f.write(render())
+    return path
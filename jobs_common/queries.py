@@ -0,0 +1,77 @@
+"""
+SQL of the queries run by the app, with SQLAlchemy style parameters (`:name`).
+`python -m jobs_common.schema --check` explains the same queries, so the indexes checked are the ones the app uses.
+"""
+
+import re
+
+from jobs_common.search import build_tsquery, tsquery_sql
+
+# The app only shows the jobs added along the last 7 days
+RECENT = "added_at > CURRENT_DATE - INTERVAL '7 day'"
+
+# Bound parameters, casts (`::`) aren't
+PARAMETER = re.compile(r"(?<![:\w]):(\w+)")
+
+UPDATE_VIEWED_QUERY = """
+    UPDATE jobs SET viewed = v.viewed
+    FROM unnest(CAST(:ids AS INTEGER[]), CAST(:viewed AS BOOLEAN[])) AS v(id, viewed)
+    WHERE jobs.id = v.id"""
+
+
+def build_filters(
+    inc_words: list[str], exc_words: list[str], full_text: bool, hide_viewed: bool
+) -> tuple[str, dict]:
+    """SQL conditions and parameters for the keywords and viewed filters"""
+    conditions = []
+    params = {}
+    if full_text:
+        # Keywords are matched through the full-text search index
+        inc_query, exc_query = build_tsquery(inc_words), build_tsquery(exc_words)
+        if inc_query:
+            conditions.append(f"search @@ {tsquery_sql('inc_query')}")
+            params["inc_query"] = inc_query
+        if exc_query:
+            conditions.append(f"NOT search @@ {tsquery_sql('exc_query')}")
+            params["exc_query"] = exc_query
+    else:
+        # Keywords are matched in the role as a case insensitive regex, like any of them
+        if inc_words:
+            conditions.append("title ~* :inc_pattern")
+            params["inc_pattern"] = "|".join(inc_words)
+        if exc_words:
+            conditions.append("title !~* :exc_pattern")
+            params["exc_pattern"] = "|".join(exc_words)
+    if hide_viewed:
+        conditions.append("NOT viewed")
+    return " AND ".join(conditions) or "TRUE", params
+
+
+def order_by(inc_words: list[str], full_text: bool) -> str:
+    """Most relevant offers first in full-text search, most recent ones otherwise"""
+    order = "added_at DESC, posted_at DESC, id"  # Order by ID to ensure order consistency in equal dates
+    if full_text and build_tsquery(inc_words):
+        order = f"ts_rank(search, {tsquery_sql('inc_query')}) DESC, {order}"
+    return order
+
+
+def count_query(conditions: str) -> str:
+    """Count of the recent offers, and of the ones matching the conditions"""
+    return f"""
+        SELECT COUNT(*), COUNT(*) FILTER (WHERE {conditions}) FROM jobs
+        WHERE {RECENT}"""
+
+
+def page_query(conditions: str, order: str) -> str:
+    """A page of the recent offers matching the conditions, with only the displayed columns"""
+    return f"""
+        SELECT id, viewed, url, title, company, location, posted_at FROM jobs
+        WHERE {RECENT}
+        AND {conditions}
+        ORDER BY {order}
+        LIMIT :limit OFFSET :offset"""
+
+
+def psycopg_query(query: str) -> str:
+    """Query with its parameters in the psycopg2 style (`%(name)s`)"""
+    return PARAMETER.sub(r"%(\1)s", query.replace("%", "%%"))
@@ -0,0 +1,119 @@
+"""
+Retention of the `jobs` table: offers not scraped again in `RETENTION_DAYS` days are archived and deleted.
+Every crawl refreshes `added_at` of the offers still published, so only the ones gone from the sites expire.
+Usage: python -m jobs_common.retention [--days N] [--batch-size N]
+"""
+
+import os
+import gzip
+import time
+import logging
+import argparse
+from datetime import date, datetime, timedelta
+from pathlib import Path
+
+import psycopg2
+
+from jobs_common.db import connection
+from jobs_common.schema import migrate
+from jobs_common.state import STATE_DIR
+
+# Deleted offers, one gzipped CSV file per run
+ARCHIVE_DIR = STATE_DIR / "archive"
+# Touched every time the retention runs
+RETENTION_STAMP = STATE_DIR / "last_retention"
+
+# Keep it above the 7 days shown by the app
+RETENTION_DAYS = 30
+# Offers deleted per transaction, so the table is never locked for long
+DELETE_BATCH_SIZE = 5000
+# Seconds between runs scheduled by the crawls
+RETENTION_INTERVAL = 24 * 3600
+
+# Expired offers are deleted and copied to the archive in the same statement
+ARCHIVE_BATCH_QUERY = """
+    COPY (
+        WITH expired AS (
+            SELECT id FROM jobs WHERE added_at < %s ORDER BY added_at, id LIMIT %s FOR UPDATE SKIP LOCKED
+        )
+        DELETE FROM jobs USING expired WHERE jobs.id = expired.id
+        RETURNING jobs.id, jobs.viewed, jobs.title, jobs.company, jobs.location,
+            jobs.posted_at, jobs.added_at, jobs.url
+    ) TO STDOUT WITH (FORMAT CSV, HEADER %s)
+    """
+
+
+def archive_batch(cur, f, cutoff: date, batch_size: int, header: bool) -> int:
+    """Delete a batch of offers added before `cutoff`, writing them to `f`. Returns how many were deleted."""
+    # COPY takes no parameters, they are bound client side
+    cur.copy_expert(cur.mogrify(ARCHIVE_BATCH_QUERY, (cutoff, batch_size, header)).decode(), f)
+    return cur.rowcount
+
+
+def apply_retention(days: int = RETENTION_DAYS, batch_size: int = DELETE_BATCH_SIZE) -> tuple[int, Path | None]:
+    """
+    Archive and delete the offers added more than `days` days ago, in batches.
+    A batch is committed only once it is flushed to the archive, so offers are never lost.
+    Returns how many offers were deleted and the archive they were written to.
+    """
+    cutoff = date.today() - timedelta(days=days)
+    ARCHIVE_DIR.mkdir(parents=True, exist_ok=True)
+    path = ARCHIVE_DIR / f"jobs-{datetime.now():%Y%m%d-%H%M%S}.csv.gz"
+
+    deleted = 0
+    with connection() as conn, conn.cursor() as cur:
+        migrate(cur)
+    with gzip.open(path, "wb") as f:
+        while True:
+            with connection() as conn, conn.cursor() as cur:
+                count = archive_batch(cur, f, cutoff, batch_size, header=not deleted)
+                # Make the batch durable before deleting it for good
+                f.flush()
+                os.fsync(f.fileobj.fileno())
+            deleted += count
+            if count < batch_size:
+                break
+
+    if not deleted:
+        path.unlink()
+        path = None
+    RETENTION_STAMP.touch()
+    return deleted, path
+
+
+def retention_due(interval: float = RETENTION_INTERVAL) -> bool:
+    """Whether the retention didn't run in the last `interval` seconds"""
+    try:
+        return time.time() - RETENTION_STAMP.stat().st_mtime >= interval
+    except FileNotFoundError:
+        return True
+
+
+def run_retention() -> None:
+    """Apply the retention if it's due, leaving it for the next time if the database is unavailable"""
+    if not retention_due():
+        return
+    try:
+        deleted, path = apply_retention()
+    except psycopg2.Error as e:
+        logging.error(f"Couldn't apply the retention, it will be retried by the next crawl: {e}")
+        return
+    if deleted:
+        logging.info(f"Retention: {deleted} expired offers archived to {path}.")
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument(
+        "-d", "--days", type=int, default=RETENTION_DAYS, help="Days offers are kept since last scraped"
+    )
+    parser.add_argument(
+        "-b", "--batch-size", type=int, default=DELETE_BATCH_SIZE, help="Offers deleted per transaction"
+    )
+    args = parser.parse_args()
+    if args.days <= 7:
+        parser.error("--days has to be above the 7 days shown by the app")
+
+    deleted, path = apply_retention(args.days, args.batch_size)
+    logging.info(f"{deleted} expired offers deleted" + (f", archived to {path}." if path else "."))
@@ -0,0 +1,188 @@
+"""
+Versioned schema of the database, shared by the crawlers and the app.
+Each migration runs once, in order, and is recorded in the `schema_migrations` table.
+Usage: python -m jobs_common.schema [--check]
+"""
+
+import sys
+import logging
+import argparse
+
+from jobs_common.db import connection
+from jobs_common.queries import (
+    UPDATE_VIEWED_QUERY,
+    build_filters,
+    count_query,
+    order_by,
+    page_query,
+    psycopg_query,
+)
+from jobs_common.search import ensure_search_index
+
+# Serializes processes migrating the same database (e.g. a crawl and the app)
+MIGRATIONS_LOCK = 4_720_241
+
+
+def create_jobs(cur) -> None:
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS jobs(
+        id SERIAL PRIMARY KEY,                                       -- Primary key for unique identification
+        viewed BOOLEAN DEFAULT FALSE,                                -- Flag to indicate if the job was applied to (it will be used later)
+        title VARCHAR(255) NOT NULL,                                 -- Job title
+        company VARCHAR(255),                                        -- Company name
+        location VARCHAR(255),                                       -- Job location
+        posted_at DATE,                                              -- Date when the job was posted
+        added_at DATE DEFAULT CURRENT_DATE,                          -- Date when the jobs was added to the database
+        url VARCHAR(2083) NOT NULL,                                  -- URL of the job listing
+        CONSTRAINT job UNIQUE (title, company, location)             -- Unique constraint for job identification
+        )"""
+    )
+
+
+def rename_viwed(cur) -> None:
+    """Tables created by the Scrapy pipeline had the column misspelled"""
+    cur.execute(
+        "SELECT 1 FROM information_schema.columns WHERE table_name = 'jobs' AND column_name = 'viwed'"
+    )
+    if cur.fetchone():
+        cur.execute("ALTER TABLE jobs RENAME COLUMN viwed TO viewed")
+
+
+def add_app_indexes(cur) -> None:
+    # The app shows the offers of the last days in this order, a page is read straight from the index
+    cur.execute(
+        "CREATE INDEX IF NOT EXISTS jobs_recent_idx ON jobs (added_at DESC, posted_at DESC, id)"
+    )
+    # Same with viewed offers hidden, the index only holds the offers still to review
+    cur.execute(
+        "CREATE INDEX IF NOT EXISTS jobs_unviewed_idx ON jobs (added_at DESC, posted_at DESC, id) WHERE NOT viewed"
+    )
+    # Lookups by URL, a hash index stays small and takes URLs too long for a B-tree
+    cur.execute("CREATE INDEX IF NOT EXISTS jobs_url_idx ON jobs USING HASH (url)")
+
+
+# Version, description and function applying the migration. Append new ones at the end, never edit applied ones
+MIGRATIONS = [
+    (1, "Create the jobs table", create_jobs),
+    (2, "Rename viwed column to viewed", rename_viwed),
+    (3, "Add the full-text search column and index", ensure_search_index),
+    (4, "Add the indexes of the app queries", add_app_indexes),
+]
+
+
+def current_version(cur) -> int:
+    cur.execute("SELECT to_regclass('schema_migrations') IS NOT NULL")
+    if not cur.fetchone()[0]:
+        return 0
+    cur.execute("SELECT COALESCE(MAX(version), 0) FROM schema_migrations")
+    return cur.fetchone()[0]
+
+
+def migrate(cur) -> list[int]:
+    """Apply the pending migrations in the transaction of the cursor, returns their versions"""
+    if current_version(cur) >= MIGRATIONS[-1][0]:
+        return []
+
+    # Check again once no one else is migrating
+    cur.execute("SELECT pg_advisory_xact_lock(%s)", (MIGRATIONS_LOCK,))
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS schema_migrations(
+        version INTEGER PRIMARY KEY,
+        description TEXT NOT NULL,
+        applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )"""
+    )
+    version = current_version(cur)
+    applied = []
+    for number, description, apply in MIGRATIONS:
+        if number <= version:
+            continue
+        logging.info(f"Applying migration {number}: {description}.")
+        apply(cur)
+        cur.execute(
+            "INSERT INTO schema_migrations(version, description) VALUES (%s, %s)",
+            (number, description),
+        )
+        applied.append(number)
+    return applied
+
+
+# Filters of the app (keywords to include and exclude, full-text search, hide viewed) checked,
+# and the index each page of results is expected to be read from
+APP_FILTERS = {
+    "no filters": (([], [], False, False), "jobs_recent_idx"),
+    "hiding viewed": (([], [], False, True), "jobs_unviewed_idx"),
+    "keywords": ((["data", "python"], ["senior"], False, False), "jobs_recent_idx"),
+    "full-text": ((["data scientist"], ["senior"], True, False), "jobs_search_idx"),
+}
+
+
+def app_queries() -> dict[str, tuple[str, dict, str]]:
+    """
+    Queries run by the app on every page load, built as the app does with representative parameters.
+    Returns the query, its parameters and the index it is expected to use by name.
+    """
+    queries = {}
+    for name, ((inc_words, exc_words, full_text, hide_viewed), expected) in APP_FILTERS.items():
+        conditions, params = build_filters(inc_words, exc_words, full_text, hide_viewed)
+        # Offers are counted while reading the recent ones, whatever the filters
+        queries[f"count, {name}"] = (count_query(conditions), params, "jobs_recent_idx")
+        queries[f"page, {name}"] = (
+            page_query(conditions, order_by(inc_words, full_text)),
+            {**params, "limit": 100, "offset": 100},
+            expected,
+        )
+    queries["update viewed"] = (UPDATE_VIEWED_QUERY, {"ids": [1, 2], "viewed": [True, False]}, "jobs_pkey")
+    return queries
+
+
+def plan_indexes(plan: dict) -> set[str]:
+    """Indexes read by a query plan and its subplans"""
+    indexes = {plan["Index Name"]} if "Index Name" in plan else set()
+    for subplan in plan.get("Plans", []):
+        indexes |= plan_indexes(subplan)
+    return indexes
+
+
+def check_indexes(cur) -> dict[str, tuple[str, set[str]]]:
+    """
+    Indexes each app query can use, found with `EXPLAIN` (queries aren't run).
+    Sequential scans are disabled, otherwise small tables would always be read whole.
+    Returns the expected index and the ones used by query name.
+    """
+    cur.execute("SET LOCAL enable_seqscan = off")
+    results = {}
+    for name, (query, params, expected) in app_queries().items():
+        cur.execute(f"EXPLAIN (FORMAT JSON) {psycopg_query(query)}", params)
+        plan = cur.fetchone()[0]
+        results[name] = (expected, plan_indexes(plan[0]["Plan"]))
+    return results
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument(
+        "--check", action="store_true", help="Check the app queries use their indexes"
+    )
+    args = parser.parse_args()
+
+    with connection() as conn, conn.cursor() as cur:
+        applied = migrate(cur)
+    logging.info(f"Schema at version {MIGRATIONS[-1][0]}, {len(applied)} migrations applied.")
+
+    if args.check:
+        with connection() as conn, conn.cursor() as cur:
+            results = check_indexes(cur)
+            conn.rollback()
+        failed = False
+        for name, (expected, used) in results.items():
+            ok = expected in used
+            failed |= not ok
+            logging.info(
+                f"{name}: {'OK' if ok else 'MISSING'} "
+                f"(expects {expected}, uses {', '.join(sorted(used)) or 'no index'})"
+            )
+        sys.exit(1 if failed else 0)
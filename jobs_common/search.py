@@ -0,0 +1,40 @@
+import re
+
+# Weighted document of an offer, role matches rank higher than company and location ones.
+# Roles are stemmed in spanish and english, since offers are published in both languages
+SEARCH_VECTOR = """
+    setweight(to_tsvector('spanish', coalesce(title, '')), 'A') ||
+    setweight(to_tsvector('english', coalesce(title, '')), 'A') ||
+    setweight(to_tsvector('simple', coalesce(company, '')), 'B') ||
+    setweight(to_tsvector('simple', coalesce(location, '')), 'C')
+"""
+
+
+def ensure_search_index(cur) -> None:
+    """Add the full-text search column and its GIN index to the `jobs` table, if missing"""
+    # Check first, altering the table locks it even if the column already exists
+    cur.execute(
+        "SELECT 1 FROM information_schema.columns WHERE table_name = 'jobs' AND column_name = 'search'"
+    )
+    if cur.fetchone():
+        return
+    cur.execute(
+        f"ALTER TABLE jobs ADD COLUMN IF NOT EXISTS search tsvector GENERATED ALWAYS AS ({SEARCH_VECTOR}) STORED"
+    )
+    cur.execute("CREATE INDEX IF NOT EXISTS jobs_search_idx ON jobs USING GIN (search)")
+
+
+def build_tsquery(phrases: list[str]) -> str | None:
+    """tsquery text matching any of the phrases, with every word of a phrase as a prefix"""
+    terms = []
+    for phrase in phrases:
+        # Keep only words, so user input can't inject tsquery operators
+        words = re.findall(r"\w+", phrase)
+        if words:
+            terms.append("(" + " & ".join(f"{w}:*" for w in words) + ")")
+    return " | ".join(terms) or None
+
+
+def tsquery_sql(param: str) -> str:
+    """SQL matching the tsquery text bound to `param` in every configuration used by the search column"""
+    return f"(to_tsquery('spanish', :{param}) || to_tsquery('english', :{param}) || to_tsquery('simple', :{param}))"
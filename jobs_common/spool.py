@@ -0,0 +1,263 @@
+"""
+Write-ahead spool of the offers scraped, so crawlers never wait on the database nor lose offers while it's down.
+Crawlers append offers to segments on disk, and the loader upserts them into the `jobs` table in large batches.
+Usage: python -m jobs_common.spool [--batch-size N]
+"""
+
+import os
+import json
+import time
+import fcntl
+import logging
+import argparse
+import threading
+from pathlib import Path
+
+import psycopg2
+
+from jobs_common.db import connection, upsert_offers
+from jobs_common.dedup import load_index
+from jobs_common.metrics import OFFERS, SAVE_SECONDS
+from jobs_common.schema import migrate
+from jobs_common.state import STATE_DIR, mark_crawl_finished, replacing
+
+SPOOL_DIR = STATE_DIR / "spool"
+SEGMENTS_DIR = SPOOL_DIR / "segments"
+# Segment being loaded and the offset of the first offer not loaded yet
+CHECKPOINT_PATH = SPOOL_DIR / "checkpoint.json"
+# Offers the database refused (e.g. a too long title)
+REJECTED_PATH = SPOOL_DIR / "rejected.jsonl"
+LOCK_PATH = SPOOL_DIR / "loader.lock"
+
+# Segments are closed once they reach this size, so they can be loaded while the crawl goes on
+SEGMENT_SIZE = 4 * 1024 * 1024
+# Offers upserted per statement by the loader
+LOAD_BATCH_SIZE = 5000
+
+FIELDS = ("title", "company", "location", "posted_at", "url")
+
+
+class SpoolWriter:
+    """
+    Appends offers to segments of the spool, one JSON line per offer. A segment is written as `.open`
+    and renamed to `.jsonl` when closed, which makes it available to the loader.
+    Safe to use from any thread.
+    """
+
+    def __init__(self, name: str, segment_size: int = SEGMENT_SIZE):
+        self.name = name
+        self.segment_size = segment_size
+        self.path = None
+        self.file = None
+        self.lock = threading.Lock()
+
+    def append(self, rows: list[tuple], source: str) -> None:
+        """Write offers given as (title, company, location, posted_at, url) tuples"""
+        if not rows:
+            return
+        data = "".join(
+            json.dumps({"source": source, **dict(zip(FIELDS, row))}, default=str) + "\n"
+            for row in rows
+        ).encode()
+        with self.lock:
+            if self.file is None:
+                self.open_segment()
+            self.file.write(data)
+            # Hand the lines to the OS, so they survive the process crashing
+            self.file.flush()
+            if self.file.tell() >= self.segment_size:
+                self.close_segment()
+
+    def open_segment(self) -> None:
+        SEGMENTS_DIR.mkdir(parents=True, exist_ok=True)
+        # Names start with the creation time, so segments are loaded in order
+        self.path = SEGMENTS_DIR / f"{time.time_ns():020d}-{os.getpid()}-{self.name}.open"
+        self.file = open(self.path, "ab")
+
+    def close_segment(self) -> None:
+        os.fsync(self.file.fileno())
+        self.file.close()
+        self.path.rename(self.path.with_suffix(".jsonl"))
+        self.path = self.file = None
+
+    def close(self) -> None:
+        """Close the current segment, the next offers start a new one"""
+        with self.lock:
+            if self.file is not None:
+                self.close_segment()
+
+
+def offer_row(offer, url_field: str = "url") -> tuple:
+    """Offer given as a mapping (dict or item) as a (title, company, location, posted_at, url) tuple"""
+    return (
+        offer.get("title"),
+        offer.get("company"),
+        offer.get("location"),
+        offer.get("posted_at"),
+        offer.get(url_field),
+    )
+
+
+def spool_offers(writer: SpoolWriter, rows: list[tuple], source: str) -> None:
+    """Append offers to the spool and record them in the shared offers index, so other spiders can skip them"""
+    writer.append(rows, source)
+    # Spooled offers will reach the database, even if it's down now
+    load_index().add(rows)
+
+
+def is_running(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def closed_segments() -> list[Path]:
+    """Segments ready to be loaded, oldest first. Segments left open by a crashed process are closed."""
+    for path in SEGMENTS_DIR.glob("*.open"):
+        pid = int(path.name.split("-")[1])
+        if not is_running(pid):
+            logging.warning(f"Recovering segment {path.name} of a process no longer running.")
+            path.rename(path.with_suffix(".jsonl"))
+    return sorted(SEGMENTS_DIR.glob("*.jsonl"))
+
+
+def read_checkpoint() -> dict:
+    try:
+        return json.loads(CHECKPOINT_PATH.read_text())
+    except FileNotFoundError:
+        return {}
+
+
+def write_checkpoint(segment: str, offset: int) -> None:
+    # A crash never leaves a partial checkpoint
+    with replacing(CHECKPOINT_PATH, "w") as f:
+        f.write(json.dumps({"segment": segment, "offset": offset}))
+
+
+def read_batches(path: Path, offset: int, batch_size: int):
+    """Batches of offers of a segment starting at `offset`, along with the offset following each batch"""
+    batch = []
+    with open(path, "rb") as f:
+        f.seek(offset)
+        for line in f:
+            offset += len(line)
+            # The process writing the segment crashed in the middle of the line
+            if not line.endswith(b"\n"):
+                logging.warning(f"Skipping truncated offer at the end of {path.name}.")
+                continue
+            try:
+                batch.append(json.loads(line))
+            except ValueError:
+                logging.warning(f"Skipping unreadable offer in {path.name}: {line[:200]!r}")
+                continue
+            if len(batch) >= batch_size:
+                yield batch, offset
+                batch = []
+    if batch:
+        yield batch, offset
+
+
+def reject(row: tuple, source: str, error: Exception) -> None:
+    logging.warning(f"Discarding invalid offer {row}: {error}")
+    OFFERS.inc(source=source, outcome="unsaved")
+    with open(REJECTED_PATH, "a", encoding="utf-8") as f:
+        data = {"source": source, **dict(zip(FIELDS, row)), "error": str(error).strip()}
+        f.write(json.dumps(data, default=str) + "\n")
+
+
+def upsert_valid(cur, rows: list[tuple], source: str) -> tuple[int, int]:
+    """Upsert rows in a single statement, falling back to one by one if any is invalid"""
+    cur.execute("SAVEPOINT batch")
+    try:
+        return upsert_offers(cur, rows)
+    except (psycopg2.DataError, psycopg2.IntegrityError):
+        cur.execute("ROLLBACK TO SAVEPOINT batch")
+
+    # An invalid offer (e.g. a too long title) rejects the whole statement, load the rest one by one
+    inserted = updated = 0
+    for row in rows:
+        cur.execute("SAVEPOINT offer")
+        try:
+            counts = upsert_offers(cur, [row])
+        except (psycopg2.DataError, psycopg2.IntegrityError) as e:
+            cur.execute("ROLLBACK TO SAVEPOINT offer")
+            reject(row, source, e)
+            continue
+        inserted += counts[0]
+        updated += counts[1]
+    return inserted, updated
+
+
+def load_batch(offers: list[dict]) -> tuple[int, int]:
+    """Upsert a batch of spooled offers in a single transaction, returns how many were inserted and updated"""
+    by_source = {}
+    for offer in offers:
+        by_source.setdefault(offer.get("source"), []).append(tuple(offer.get(f) for f in FIELDS))
+
+    inserted = updated = 0
+    with connection() as conn, conn.cursor() as cur:
+        for source, rows in by_source.items():
+            with SAVE_SECONDS.time(source=source):
+                counts = upsert_valid(cur, rows, source)
+            OFFERS.inc(counts[0], source=source, outcome="inserted")
+            OFFERS.inc(counts[1], source=source, outcome="updated")
+            inserted += counts[0]
+            updated += counts[1]
+    return inserted, updated
+
+
+def load_segments(batch_size: int) -> tuple[int, int]:
+    segments = closed_segments()
+    if not segments:
+        return 0, 0
+    with connection() as conn, conn.cursor() as cur:
+        migrate(cur)
+
+    checkpoint = read_checkpoint()
+    inserted = updated = 0
+    for path in segments:
+        offset = checkpoint.get("offset", 0) if checkpoint.get("segment") == path.name else 0
+        for offers, offset in read_batches(path, offset, batch_size):
+            counts = load_batch(offers)
+            inserted += counts[0]
+            updated += counts[1]
+            # Committed, a crash from now on replays the segment from here
+            write_checkpoint(path.name, offset)
+        path.unlink()
+
+    if inserted or updated:
+        mark_crawl_finished()
+    return inserted, updated
+
+
+def drain(batch_size: int = LOAD_BATCH_SIZE, wait: bool = True) -> tuple[int, int] | None:
+    """
+    Load the closed segments into the `jobs` table, oldest first, resuming from the checkpoint.
+    Offers loaded twice (after a crash between a commit and its checkpoint) are just refreshed by the upsert.
+    Returns how many offers were inserted and updated, or None if another loader is running and `wait` is False.
+    Raises `psycopg2.Error` if the database is unavailable, the offers not loaded stay in the spool.
+    """
+    SEGMENTS_DIR.mkdir(parents=True, exist_ok=True)
+    # A single loader at a time, across processes
+    with open(LOCK_PATH, "a") as lock:
+        try:
+            fcntl.flock(lock, fcntl.LOCK_EX if wait else fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            return None
+        return load_segments(batch_size)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument(
+        "-b", "--batch-size", type=int, default=LOAD_BATCH_SIZE, help="Offers upserted per statement"
+    )
+    args = parser.parse_args()
+
+    inserted, updated = drain(args.batch_size)
+    logging.info(f"Spool loaded: {inserted} new offers, {updated} updated.")
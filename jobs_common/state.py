@@ -0,0 +1,40 @@
+import os
+from contextlib import contextmanager
+from pathlib import Path
+
+# Folder where crawlers keep data between runs, set CRAWL_STATE_DIR to use another one (e.g. in benchmarks)
+STATE_DIR = Path(
+    os.getenv("CRAWL_STATE_DIR", Path(__file__).resolve().parents[1] / ".crawl_state")
+)
+
+# Touched every time a crawler finishes saving offers
+CRAWL_STAMP = STATE_DIR / "last_crawl"
+
+
+def mark_crawl_finished() -> None:
+    """Let readers of the database (e.g. the app) know there are new offers"""
+    STATE_DIR.mkdir(parents=True, exist_ok=True)
+    CRAWL_STAMP.touch()
+
+
+@contextmanager
+def replacing(path: Path, mode: str = "wb"):
+    """
+    File object replacing `path` once the block exits, written to a temporary file in the meantime.
+    Readers never see a partial file, and it's left untouched if the block fails.
+    """
+    tmp_path = path.with_suffix(f".{os.getpid()}.tmp")
+    try:
+        with open(tmp_path, mode) as f:
+            yield f
+        os.replace(tmp_path, path)
+    finally:
+        tmp_path.unlink(missing_ok=True)
+
+
+def crawl_version() -> int:
+    """Changes every time a crawler finishes, 0 if none did yet"""
+    try:
+        return CRAWL_STAMP.stat().st_mtime_ns
+    except FileNotFoundError:
+        return 0
@@ -0,0 +1,5 @@
+import sys
+from pathlib import Path
+
+# Make the modules shared with the other crawlers importable
+sys.path.append(str(Path(__file__).resolve().parents[2]))
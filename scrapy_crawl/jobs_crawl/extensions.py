@@ -0,0 +1,59 @@
+# Define here your extensions
+#
+# See documentation in:
+# https://docs.scrapy.org/en/latest/topics/extensions.html
+
+from scrapy import signals
+from scrapy.exceptions import NotConfigured
+from twisted.internet import task
+
+from jobs_common.metrics import OFFERS, PAGE_SECONDS, write_metrics
+
+
+class CrawlMetrics:
+    """
+    Records the offers kept and dropped by the pipelines and the time taken by each download in the crawl metrics,
+    writing them to METRICS_DIR/<METRICS_NAME>.prom every METRICS_INTERVAL seconds and when the spider closes.
+    `{spider}` in METRICS_NAME is replaced by the spider name, so spiders crawling at the same time in
+    different processes don't overwrite each other's file. The pipelines record their own stages.
+    """
+
+    def __init__(self, name: str, interval: float):
+        self.name = name
+        self.interval = interval
+        self.write_task = None
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        if not crawler.settings.getbool("METRICS_ENABLED"):
+            raise NotConfigured
+        name = crawler.settings.get("METRICS_NAME").format(spider=crawler.spidercls.name)
+        ext = cls(name, crawler.settings.getfloat("METRICS_INTERVAL"))
+        crawler.signals.connect(ext.spider_opened, signal=signals.spider_opened)
+        crawler.signals.connect(ext.spider_closed, signal=signals.spider_closed)
+        crawler.signals.connect(ext.item_scraped, signal=signals.item_scraped)
+        crawler.signals.connect(ext.item_dropped, signal=signals.item_dropped)
+        crawler.signals.connect(ext.response_received, signal=signals.response_received)
+        return ext
+
+    def spider_opened(self, spider):
+        if self.interval > 0:
+            self.write_task = task.LoopingCall(write_metrics, self.name)
+            self.write_task.start(self.interval, now=False)
+
+    def spider_closed(self, spider):
+        if self.write_task and self.write_task.running:
+            self.write_task.stop()
+        write_metrics(self.name)
+
+    def item_scraped(self, item, response, spider):
+        OFFERS.inc(source=spider.name, outcome="kept")
+
+    def item_dropped(self, item, response, exception, spider):
+        OFFERS.inc(source=spider.name, outcome="dropped")
+
+    def response_received(self, response, request, spider):
+        # Cached responses aren't downloaded
+        latency = request.meta.get("download_latency")
+        if latency is not None and "cached" not in response.flags:
+            PAGE_SECONDS.observe(latency, source=spider.name)
@@ -0,0 +1,140 @@
+# HTTP cache backends, plugged into Scrapy's HttpCacheMiddleware through
+# the HTTPCACHE_STORAGE and HTTPCACHE_POLICY settings.
+# See: https://docs.scrapy.org/en/latest/topics/downloader-middleware.html#httpcache-middleware-settings
+
+import zlib
+import sqlite3
+import logging
+from pathlib import Path
+from time import time
+
+from scrapy.extensions.httpcache import RFC2616Policy
+from scrapy.http import Headers
+from scrapy.responsetypes import responsetypes
+from scrapy.utils.project import data_path
+from w3lib.http import headers_dict_to_raw, headers_raw_to_dict
+
+logger = logging.getLogger(__name__)
+
+
+class TTLPolicy(RFC2616Policy):
+    """
+    Cached responses are used without any request while younger than HTTPCACHE_TTL seconds
+    (a spider can set its own in `custom_settings`).
+    Older ones are revalidated with `If-Modified-Since`/`If-None-Match` when the site sent a
+    `Last-Modified`/`ETag` header, and downloaded again otherwise.
+    """
+
+    def __init__(self, settings):
+        super().__init__(settings)
+        self.ttl = settings.getint("HTTPCACHE_TTL")
+        self.ignore_http_codes = {int(c) for c in settings.getlist("HTTPCACHE_IGNORE_HTTP_CODES")}
+
+    def should_cache_response(self, response, request):
+        # Listing pages are usually sent without cache headers, keep them for the TTL anyway
+        if response.status in self.ignore_http_codes or response.status == 304:
+            return False
+        return self.ttl > 0 or super().should_cache_response(response, request)
+
+    def is_cached_response_fresh(self, cachedresponse, request):
+        stored_at = request.meta.get("cache_timestamp", 0)
+        if time() - stored_at < self.ttl:
+            return True
+        # Sets the validators for the conditional request
+        return super().is_cached_response_fresh(cachedresponse, request)
+
+
+class SQLiteCacheStorage:
+    """
+    Responses of each spider in a single SQLite file, keyed by the request fingerprint,
+    with the body compressed. Once the file grows over HTTPCACHE_MAX_SIZE megabytes,
+    the least recently used responses are evicted when the spider closes.
+    """
+
+    def __init__(self, settings):
+        self.cachedir = data_path(settings["HTTPCACHE_DIR"], createdir=True)
+        self.expiration_secs = settings.getint("HTTPCACHE_EXPIRATION_SECS")
+        self.max_size = settings.getint("HTTPCACHE_MAX_SIZE") * 1024 * 1024
+        self.db = None
+
+    def open_spider(self, spider):
+        path = Path(self.cachedir, f"{spider.name}.sqlite")
+        # Autocommit, spiders of the same name running together share the file
+        self.db = sqlite3.connect(path, timeout=30, isolation_level=None)
+        self.db.execute("PRAGMA journal_mode = WAL")
+        self.db.execute(
+            """
+            CREATE TABLE IF NOT EXISTS responses (
+                fingerprint TEXT PRIMARY KEY,
+                url TEXT NOT NULL,
+                status INTEGER NOT NULL,
+                headers BLOB NOT NULL,
+                body BLOB NOT NULL,
+                size INTEGER NOT NULL,
+                stored_at REAL NOT NULL,
+                used_at REAL NOT NULL
+            )
+            """
+        )
+        self.db.execute("CREATE INDEX IF NOT EXISTS responses_used_at ON responses (used_at)")
+        logger.debug(f"Using SQLite cache storage in {path}", extra={"spider": spider})
+
+        self._fingerprinter = spider.crawler.request_fingerprinter
+
+    def close_spider(self, spider):
+        self.evict(spider)
+        self.db.close()
+
+    def evict(self, spider) -> None:
+        """Delete the least recently used responses until the cache fits in HTTPCACHE_MAX_SIZE"""
+        if self.max_size <= 0:
+            return
+        (total,) = self.db.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()
+        if total <= self.max_size:
+            return
+        # Keep the most recently used responses adding up to the max size
+        deleted = self.db.execute(
+            """
+            DELETE FROM responses WHERE fingerprint IN (
+                SELECT fingerprint FROM (
+                    SELECT fingerprint, SUM(size) OVER (ORDER BY used_at DESC) AS cumulative
+                    FROM responses
+                ) WHERE cumulative > ?
+            )
+            """,
+            (self.max_size,),
+        ).rowcount
+        self.db.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        self.db.execute("VACUUM")
+        logger.info(f"Evicted {deleted} responses from the HTTP cache.", extra={"spider": spider})
+
+    def retrieve_response(self, spider, request):
+        """Return response if present in cache, or None otherwise."""
+        key = self._fingerprinter.fingerprint(request).hex()
+        row = self.db.execute(
+            "SELECT url, status, headers, body, stored_at FROM responses WHERE fingerprint = ?",
+            (key,),
+        ).fetchone()
+        if row is None:
+            return None  # not cached
+        url, status, raw_headers, body, stored_at = row
+        if 0 < self.expiration_secs < time() - stored_at:
+            return None  # expired
+        self.db.execute("UPDATE responses SET used_at = ? WHERE fingerprint = ?", (time(), key))
+
+        headers = Headers(headers_raw_to_dict(raw_headers))
+        body = zlib.decompress(body)
+        respcls = responsetypes.from_args(headers=headers, url=url, body=body)
+        request.meta["cache_timestamp"] = stored_at
+        return respcls(url=url, headers=headers, status=status, body=body)
+
+    def store_response(self, spider, request, response):
+        """Store the given response in the cache."""
+        key = self._fingerprinter.fingerprint(request).hex()
+        headers = headers_dict_to_raw(response.headers)
+        body = zlib.compress(response.body, 6)
+        now = time()
+        self.db.execute(
+            "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            (key, response.url, response.status, headers, body, len(headers) + len(body), now, now),
+        )
@@ -3,6 +3,11 @@
 # See documentation in:
 # https://docs.scrapy.org/en/latest/topics/spider-middleware.html
 
+import json
+import time
+from email.utils import parsedate_to_datetime
+from pathlib import Path
+
 from scrapy import signals
 
 # useful for handling different item types with a single interface
@@ -56,48 +61,113 @@ class JobsCrawlSpiderMiddleware:
         spider.logger.info("Spider opened: %s" % spider.name)
 
 
-class JobsCrawlDownloaderMiddleware:
-    # Not all methods need to be defined. If a method is not defined,
-    # scrapy acts as if the downloader middleware does not modify the
-    # passed objects.
+class AdaptiveThrottleMiddleware:
+    """
+    AIMD throttling of each domain (downloader slot), replacing AutoThrottle.
+    Successful responses raise the request rate additively and, once at the max rate, the concurrency.
+    A 429 response cuts both multiplicatively, honouring its `Retry-After` header.
+    The rates learned are saved in CRAWL_STATE_DIR and used as the starting point of the next runs,
+    new domains start at DOWNLOAD_DELAY and CONCURRENT_REQUESTS_PER_DOMAIN.
+    """
+
+    def __init__(self, settings, stats):
+        self.stats = stats
+        self.state_file = Path(settings.get("CRAWL_STATE_DIR")) / "throttle.json"
+        self.max_concurrency = settings.getint("THROTTLE_MAX_CONCURRENCY")
+        self.min_delay = settings.getfloat("THROTTLE_MIN_DELAY")
+        self.max_delay = settings.getfloat("THROTTLE_MAX_DELAY")
+        self.rate_step = settings.getfloat("THROTTLE_RATE_STEP")
+        self.backoff = settings.getfloat("THROTTLE_BACKOFF")
+        self.domains = {}  # slot key -> {"concurrency", "delay", "backoff_at"}
 
     @classmethod
     def from_crawler(cls, crawler):
-        # This method is used by Scrapy to create your spiders.
-        s = cls()
+        s = cls(crawler.settings, crawler.stats)
+        s.crawler = crawler
         crawler.signals.connect(s.spider_opened, signal=signals.spider_opened)
+        crawler.signals.connect(s.spider_closed, signal=signals.spider_closed)
         return s
 
-    def process_request(self, request, spider):
-        # Called for each request that goes through the downloader
-        # middleware.
+    def load_state(self) -> dict:
+        """Concurrency and delay learned for each domain"""
+        if not self.state_file.exists():
+            return {}
+        return json.loads(self.state_file.read_text())
 
-        # Must either:
-        # - return None: continue processing this request
-        # - or return a Response object
-        # - or return a Request object
-        # - or raise IgnoreRequest: process_exception() methods of
-        #   installed downloader middleware will be called
-        return None
+    def spider_opened(self, spider):
+        # Slots are created with the settings of DOWNLOAD_SLOTS, start from the learned rates
+        downloader = self.crawler.engine.downloader
+        for key, rate in self.load_state().items():
+            downloader.per_slot_settings.setdefault(key, {}).update(
+                concurrency=int(rate["concurrency"]), delay=rate["delay"]
+            )
+
+    def spider_closed(self, spider):
+        if not self.domains:
+            return
+        state = self.load_state()
+        for key, domain in self.domains.items():
+            state[key] = {"concurrency": domain["concurrency"], "delay": domain["delay"]}
+        self.state_file.parent.mkdir(parents=True, exist_ok=True)
+        self.state_file.write_text(json.dumps(state, indent=2))
 
     def process_response(self, request, response, spider):
-        # Called with the response returned from the downloader.
-
-        # Must either;
-        # - return a Response object
-        # - return a Request object
-        # - or raise IgnoreRequest
+        key = request.meta.get("download_slot")
+        slot = self.crawler.engine.downloader.slots.get(key)
+        # Cached responses say nothing about the site
+        if slot is None or "cached" in response.flags:
+            return response
+
+        domain = self.domains.setdefault(
+            key, {"concurrency": slot.concurrency, "delay": slot.delay, "backoff_at": 0}
+        )
+        if response.status == 429:
+            self.decrease(key, domain, request, response, spider)
+        elif response.status < 400:
+            self.increase(domain)
+        slot.concurrency = int(domain["concurrency"])
+        slot.delay = domain["delay"]
         return response
 
-    def process_exception(self, request, exception, spider):
-        # Called when a download handler or a process_request()
-        # (from other downloader middleware) raises an exception.
-
-        # Must either:
-        # - return None: continue processing this exception
-        # - return a Response object: stops process_exception() chain
-        # - return a Request object: stops process_exception() chain
-        pass
-
-    def spider_opened(self, spider):
-        spider.logger.info("Spider opened: %s" % spider.name)
+    def increase(self, domain: dict) -> None:
+        """Additive increase of the requests per second, and of the concurrency once at the min delay"""
+        if domain["delay"] > self.min_delay:
+            rate = 1 / domain["delay"] + self.rate_step
+            domain["delay"] = max(1 / rate, self.min_delay)
+        else:
+            # Grows by one every `concurrency` responses
+            domain["concurrency"] = min(
+                domain["concurrency"] + 1 / domain["concurrency"], self.max_concurrency
+            )
+
+    def decrease(self, key: str, domain: dict, request, response, spider) -> None:
+        """Multiplicative decrease of the concurrency and rate, once per round of requests"""
+        sent_at = time.time() - request.meta.get("download_latency", 0)
+        # Requests sent before the last back off were sent at the old rate
+        if sent_at < domain["backoff_at"]:
+            return
+        domain["backoff_at"] = time.time()
+        domain["concurrency"] = max(domain["concurrency"] * self.backoff, 1)
+        delay = max(domain["delay"], self.min_delay) / self.backoff
+        retry_after = parse_retry_after(response.headers.get(b"Retry-After"))
+        if retry_after:
+            delay = max(delay, retry_after)
+        domain["delay"] = min(delay, self.max_delay)
+        self.stats.inc_value("throttle/backoff", spider=spider)
+        spider.logger.info(
+            f"Too many requests to {key}, backing off to {int(domain['concurrency'])} "
+            f"concurrent requests every {domain['delay']:.2f}s."
+        )
+
+
+def parse_retry_after(value) -> float | None:
+    """Seconds to wait given by a Retry-After header, as a number of seconds or a date"""
+    if not value:
+        return None
+    value = value.decode("latin-1").strip()
+    if value.isdigit():
+        return float(value)
+    try:
+        return max(parsedate_to_datetime(value).timestamp() - time.time(), 0)
+    except (TypeError, ValueError):
+        return None
@@ -5,147 +5,433 @@
 
 
 # useful for handling different item types with a single interface
-import os
-from datetime import datetime, timedelta
-from dateutil.relativedelta import relativedelta
+import json
+import functools
 
 from itemadapter import ItemAdapter
 from scrapy.exceptions import DropItem
+from twisted.internet import defer, task, threads
+from twisted.python.threadpool import ThreadPool
 import psycopg2
-from dotenv import load_dotenv
+
+from jobs_common.dates import to_date
+from jobs_common.db import getconn, putconn, upsert_offers
+from jobs_common.dedup import DEDUP_MAX_AGE_DAYS, load_index, offer_key
+from jobs_common.metrics import OFFERS, SAVE_SECONDS, STAGE_SECONDS
+from jobs_common.schema import migrate
+from jobs_common.spool import SpoolWriter, drain, offer_row, spool_offers
+from jobs_common.state import mark_crawl_finished
+
+
+def timed_stage(stage: str):
+    """Record the time `process_item` takes per item in the crawl metrics, dropped items included"""
+
+    def decorator(process_item):
+        @functools.wraps(process_item)
+        def wrapper(self, item, spider):
+            with STAGE_SECONDS.time(source=spider.name, stage=stage):
+                return process_item(self, item, spider)
+
+        return wrapper
+
+    return decorator
+
+
+def item_row(item) -> tuple:
+    """Offer as a (title, company, location, posted_at, url) tuple"""
+    return offer_row(ItemAdapter(item))
 
 
 class PostedAtToDatePipeline:
     """
     A pipeline that processes the `posted_at` field of an item and converts it to a `datetime.date`.
+    Linkedin gives ISO formatted dates, other sites relative ones ("3 días"), both handled by `jobs_common.dates`.
     """
 
-    def __init__(self):
-        # Actual time
-        self.now = datetime.now()
-
-        self.spain_names = {
-            "año": "year",
-            "mes": "month",
-            "semana": "week",
-            "día": "day",
-            "hora": "hour",
-            "minuto": "minute",
-            "segundo": "second",
-        }
-
+    @timed_stage("dates")
     def process_item(self, item, spider):
         adapter = ItemAdapter(item)
-        # Handle different date formats
-        if spider.name == "linkedin_spider":
-            adapter["posted_at"] = datetime.strptime(
-                adapter["posted_at"], "%Y-%m-%d"
-            ).date()
-        else:
-            quantity, unit = adapter.get("posted_at").split()
-            quantity = int(quantity)
-
-            # Handle singular and plural forms of units
-            unit = unit.lower().rstrip("s")
-
-            # Translate spanish units names
-            if unit in self.spain_names.keys():
-                unit = self.spain_names[unit]
-
-            # Map unit to the appropriate timedelta or relativedelta
-            if unit in ["week", "day", "hour", "minute", "second"]:
-                delta = timedelta(
-                    **{unit + "s": quantity}
-                )  # Use plural form for timedelta
-                adapter["posted_at"] = (self.now - delta).date()
-            else:
-                delta = relativedelta(
-                    **{unit + "s": quantity}
-                )  # Use plural form for relativedelta
-                adapter["posted_at"] = (self.now - delta).date()
+        posted_at = to_date(adapter.get("posted_at"))
+        if posted_at is None:
+            spider.logger.warning(f"Unknown date format: {adapter.get('posted_at')!r}.")
+        adapter["posted_at"] = posted_at
         return item
 
 
 class RemoveDuplicatesPipeline:
     """
     A pipeline that removes duplicate items based on the 'title', 'company', and 'location' fields.
+    Offers saved by any spider in the last `DEDUP_MAX_AGE_DAYS` days (`jobs_common.dedup`) are dropped too,
+    through the shared offers index.
     """
 
-    def __init__(self):
-        self.offers_seen = set()
+    def __init__(self, max_age_days: int = DEDUP_MAX_AGE_DAYS):
+        self.max_age_days = max_age_days
 
+    def open_spider(self, spider):
+        self.index = load_index()
+
+    @timed_stage("dedup")
     def process_item(self, item, spider):
         adapter = ItemAdapter(item)
-        values = (adapter["title"], adapter["company"], adapter["location"])
-        if values in self.offers_seen:
+        key = offer_key(adapter["title"], adapter["company"], adapter["location"])
+        if self.index.is_duplicate(key):
             raise DropItem("Job offer duplicated.")
-        else:
-            self.offers_seen.add(values)
-            return item
+        if self.index.is_fresh(key, self.max_age_days):
+            raise DropItem("Job offer already stored.")
+        return item
+
+
+class SpoolPipeline:
+    """
+    A pipeline that appends items to the local spool (`jobs_common.spool`), so the crawl never waits on
+    PostgreSQL nor loses offers while it's down. The spool is loaded into the database when the spider closes,
+    offers that couldn't be loaded stay there for the next crawl (or `python -m jobs_common.spool`).
+    """
+
+    def __init__(self, load_on_close: bool = True):
+        self.load_on_close = load_on_close
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        return cls(load_on_close=crawler.settings.getbool("SPOOL_LOAD_ON_CLOSE", True))
+
+    def open_spider(self, spider):
+        self.writer = SpoolWriter(spider.name)
+        self.index = load_index()
+
+    @timed_stage("spool")
+    def process_item(self, item, spider):
+        spool_offers(self.writer, [item_row(item)], spider.name)
+        return item
+
+    def close_spider(self, spider):
+        self.writer.close()
+        self.index.save()
+        if not self.load_on_close:
+            return None
+
+        # Don't wait for another loader (e.g. a spider of the same crawl), it takes this segment or the next one does
+        d = threads.deferToThread(drain, wait=False)
+        d.addCallbacks(self.loaded, self.load_failed, callbackArgs=(spider,), errbackArgs=(spider,))
+        return d
+
+    def loaded(self, counts, spider) -> None:
+        if counts is None:
+            spider.logger.info("Another loader is running, leaving the spool to it.")
+            return
+        inserted, updated = counts
+        spider.logger.info(f"Spool loaded: {inserted} new offers, {updated} updated.")
+
+    def load_failed(self, failure, spider) -> None:
+        spider.logger.error(
+            f"Couldn't load the spool into the database, offers stay there for the next run: {failure.value}"
+        )
 
 
 class SavingToSQLPipeline:
     """
     A pipeline that saves items to a PostgreSQL database.
+    Items are buffered and written as a single multi-row upsert when `SQL_BATCH_SIZE` items are collected,
+    every `SQL_FLUSH_INTERVAL` seconds and when the spider closes.
     """
-    def __init__(self):
-        load_dotenv()
 
-        # Database URL
-        PSQL_CONFIG = {
-            "user": os.getenv("PSQL_USER"),
-            "password": os.getenv("PSQL_PASSWORD"),
-            "host": os.getenv("PSQL_HOST"),
-            "dbname": os.getenv("PSQL_DB"),
-        }
+    def __init__(self, batch_size: int = 100, flush_interval: float = 5):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.flush_task = None
+
+        # Pending rows keyed by the unique constraint, a multi-row upsert can't affect the same row twice
+        self.buffer = {}
+        # Saved offers are recorded in the shared index, so other spiders can skip them
+        self.index = load_index()
+
+        self.connect()
 
-        # Connect to my database
-        self.conn = psycopg2.connect(**PSQL_CONFIG)
+        # Create or update the schema
+        migrate(self.cur)
+        self.conn.commit()
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        return cls(
+            batch_size=crawler.settings.getint("SQL_BATCH_SIZE", 100),
+            flush_interval=crawler.settings.getfloat("SQL_FLUSH_INTERVAL", 5),
+        )
+
+    def connect(self):
+        """Borrow a connection from the pool shared with the other crawlers"""
+        self.conn = getconn()
 
         # Create cursor, used to execute commands
         self.cur = self.conn.cursor()
 
-        # Create jobs table if none exists
-        self.cur.execute(
-            """
-            CREATE TABLE IF NOT EXISTS jobs(
-            id SERIAL PRIMARY KEY,                               -- Primary key for unique identification
-            viwed BOOLEAN DEFAULT FALSE,                         -- Flag to indicate if the job was applied to (it will be used later)
-            title VARCHAR(255) NOT NULL,                         -- Job title
-            company VARCHAR(255),                                -- Company name
-            location VARCHAR(255),                               -- Job location
-            posted_at DATE,                                      -- Date when the job was posted
-            added_at DATE DEFAULT CURRENT_DATE,                  -- Date when the jobs was added to the database
-            url VARCHAR(2083) NOT NULL,                          -- URL of the job listing
-            CONSTRAINT job UNIQUE (title, company, location)     -- Unique constraint for job identification
-            )"""
-        )
+    def open_spider(self, spider):
+        # Flush on a timer too, so slow crawls don't keep items in memory until the batch is full
+        if self.flush_interval > 0:
+            self.flush_task = task.LoopingCall(self.flush, spider)
+            self.flush_task.start(self.flush_interval, now=False)
+
+    def buffer_item(self, item) -> None:
+        row = item_row(item)
+        self.buffer[row[:3]] = row
+
+    @timed_stage("buffer")
+    def process_item(self, item, spider):
+        self.buffer_item(item)
+        if len(self.buffer) >= self.batch_size:
+            self.flush(spider)
+        return item
+
+    def take_batch(self) -> dict:
+        """Detach the buffered rows so new items can keep arriving while they are written"""
+        batch, self.buffer = self.buffer, {}
+        return batch
+
+    def restore_batch(self, batch: dict) -> None:
+        """Put back the rows of a failed batch, rows buffered in the meantime are newer and win"""
+        batch.update(self.buffer)
+        self.buffer = batch
+
+    def write_batch(self, rows: list, spider) -> None:
+        """Upsert rows in a single statement and commit"""
+        with SAVE_SECONDS.time(source=spider.name):
+            self.upsert_batch(rows, spider)
+
+    def upsert_batch(self, rows: list, spider) -> None:
+        try:
+            self.saved(upsert_offers(self.cur, rows), rows, spider)
+        except (psycopg2.DataError, psycopg2.IntegrityError):
+            self.conn.rollback()
+            # An invalid offer (e.g. a too long title) rejects the whole statement, save the rest one by one
+            for row in rows:
+                try:
+                    self.saved(upsert_offers(self.cur, [row]), [row], spider)
+                except (psycopg2.DataError, psycopg2.IntegrityError) as e:
+                    self.conn.rollback()
+                    spider.logger.warning(f"Discarding invalid offer {row}: {e}")
+                    OFFERS.inc(source=spider.name, outcome="unsaved")
+
+    def saved(self, counts: tuple[int, int], rows: list, spider) -> None:
+        """Commit the rows just upserted, recording them in the index and the crawl stats"""
         self.conn.commit()
+        self.index.add(rows)
+        inserted, updated = counts
+        spider.crawler.stats.inc_value("jobs/inserted", inserted)
+        spider.crawler.stats.inc_value("jobs/updated", updated)
+        OFFERS.inc(inserted, source=spider.name, outcome="inserted")
+        OFFERS.inc(updated, source=spider.name, outcome="updated")
+
+    def flush(self, spider) -> bool:
+        """Write the buffered items. Returns False if they couldn't be saved and remain buffered."""
+        if not self.buffer:
+            return True
+
+        batch = self.take_batch()
+        try:
+            self.write_batch(list(batch.values()), spider)
+        except psycopg2.Error as e:
+            spider.logger.error(
+                f"Couldn't save {len(batch)} offers, keeping them for the next flush: {e}"
+            )
+            self.restore_batch(batch)
+            self.reset_connection(spider)
+            return False
+        return True
+
+    def reset_connection(self, spider) -> None:
+        """Leave the connection usable after a failed write, reconnecting if it was lost"""
+        try:
+            if self.conn.closed:
+                putconn(self.conn)
+                self.connect()
+            else:
+                self.conn.rollback()
+        except psycopg2.Error as e:
+            spider.logger.error(f"Database unavailable: {e}")
+
+    def dump_unsaved(self, spider) -> None:
+        """Write the items that couldn't be saved to a local file, so they can be loaded later"""
+        path = f"unsaved_offers_{spider.name}.jsonl"
+        with open(path, "a", encoding="utf-8") as f:
+            for row in self.buffer.values():
+                data = dict(zip(("title", "company", "location", "posted_at", "url"), row))
+                f.write(json.dumps(data, default=str) + "\n")
+        spider.logger.error(f"{len(self.buffer)} offers couldn't be saved, dumped to {path}")
+        OFFERS.inc(len(self.buffer), source=spider.name, outcome="unsaved")
+
+    def close_spider(self, spider):
+        if self.flush_task and self.flush_task.running:
+            self.flush_task.stop()
 
+        # Last chance to save the pending items
+        if not self.flush(spider):
+            self.dump_unsaved(spider)
+        self.index.save()
+        mark_crawl_finished()
+
+        # Close cursor & give the connection back
+        self.cur.close()
+        putconn(self.conn)
+
+
+class AsyncSavingToSQLPipeline(SavingToSQLPipeline):
+    """
+    A non-blocking variant of `SavingToSQLPipeline`. Batches are written from a dedicated thread,
+    so downloading and parsing continue while the database works.
+    Once `SQL_MAX_PENDING` items are waiting to be saved, `process_item` holds items until the
+    current batch is written, which keeps memory bounded when the database is slower than the crawl.
+    A failed batch is retried after `SQL_RETRY_DELAY` seconds, doubled on each failure, with the items held.
+    After `SQL_MAX_RETRIES` failures in a row the pending items are dumped to a file and the crawl goes on.
+    """
+
+    def __init__(
+        self,
+        batch_size: int = 100,
+        flush_interval: float = 5,
+        max_pending: int = 1000,
+        retry_delay: float = 1,
+        max_retries: int = 5,
+    ):
+        super().__init__(batch_size, flush_interval)
+        self.max_pending = max_pending
+        self.retry_delay = retry_delay
+        self.max_retries = max_retries
+        self.failures = 0  # Batches failed in a row
+        self.retry_call = None  # Delayed call retrying a failed batch
+        self.closing = False
+
+        # The connection can't be used by concurrent writers, a single thread also keeps batches in order
+        self.pool = ThreadPool(minthreads=1, maxthreads=1, name="sql-writer")
+        self.writing = None  # Deferred of the batch being written
+        self.in_flight = 0
+        self.waiters = []
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        return cls(
+            batch_size=crawler.settings.getint("SQL_BATCH_SIZE", 100),
+            flush_interval=crawler.settings.getfloat("SQL_FLUSH_INTERVAL", 5),
+            max_pending=crawler.settings.getint("SQL_MAX_PENDING", 1000),
+            retry_delay=crawler.settings.getfloat("SQL_RETRY_DELAY", 1),
+            max_retries=crawler.settings.getint("SQL_MAX_RETRIES", 5),
+        )
+
+    def open_spider(self, spider):
+        self.pool.start()
+        super().open_spider(spider)
+
+    @timed_stage("buffer")
     def process_item(self, item, spider):
-        # Define insert statement
-        self.cur.execute(
-            """
-            INSERT INTO jobs(title, company, location, posted_at, url) 
-            VALUES (%s, %s, %s, %s, %s)
-            ON CONFLICT (title, company, location) 
-            DO UPDATE SET 
-                added_at = CURRENT_DATE,
-                url = EXCLUDED.url;
-            """,
-            (
-                item.get("title"),
-                item.get("company", None),
-                item.get("location", None),
-                item.get("posted_at", None),
-                item.get("url"),
-            ),
+        self.buffer_item(item)
+        if len(self.buffer) >= self.batch_size:
+            self.flush(spider)
+
+        # Backpressure: hold the item until the database catches up
+        if len(self.buffer) + self.in_flight >= self.max_pending:
+            d = self.wait_for_write()
+            d.addCallback(lambda _: item)
+            return d
+        return item
+
+    def wait_for_write(self) -> defer.Deferred:
+        """Deferred fired when the batch being written is done, right away if there is none"""
+        if self.writing is None and not self.retrying():
+            return defer.succeed(None)
+        d = defer.Deferred()
+        self.waiters.append(d)
+        return d
+
+    def flush(self, spider) -> None:
+        """Start writing the buffered items in the writer thread, unless a batch is already on its way"""
+        from twisted.internet import reactor
+
+        # A failed batch is retried by its own timer
+        if self.writing is not None or self.retrying() or not self.buffer:
+            return
+
+        batch = self.take_batch()
+        self.in_flight = len(batch)
+        self.writing = threads.deferToThreadPool(
+            reactor, self.pool, self.write_batch, list(batch.values()), spider
+        )
+        self.writing.addCallbacks(
+            self.batch_saved,
+            self.batch_failed,
+            callbackArgs=(spider,),
+            errbackArgs=(batch, spider),
         )
 
-        # Execute insert of data into database
-        self.conn.commit()
+    def retrying(self) -> bool:
+        return self.retry_call is not None and self.retry_call.active()
 
+    def retry(self, spider) -> None:
+        self.retry_call = None
+        self.flush(spider)
+
+    def batch_saved(self, _, spider) -> None:
+        self.failures = 0
+        self.batch_done()
+        # Items kept arriving while writing, don't wait for the timer if there is a full batch
+        if len(self.buffer) >= self.batch_size:
+            self.flush(spider)
+
+    def batch_failed(self, failure, batch: dict, spider) -> None:
+        from twisted.internet import reactor
+
+        self.restore_batch(batch)
+        self.reset_connection(spider)
+        self.writing = None
+        self.in_flight = 0
+        self.failures += 1
+        if self.closing:
+            # No more retries, what's left is dumped by `close_spider`
+            self.release_waiters()
+            return
+        if self.failures >= self.max_retries:
+            # The database is still down: spill the pending items to disk instead of holding the crawl
+            # or buffering without bound, then let the held items go
+            self.dump_unsaved(spider)
+            self.buffer = {}
+            self.failures = 0
+            self.release_waiters()
+            return
+
+        # Held items keep waiting until the retry
+        delay = self.retry_delay * 2 ** (self.failures - 1)
+        spider.logger.error(
+            f"Couldn't save {len(self.buffer)} offers, retrying in {delay:g}s: {failure.value}"
+        )
+        self.retry_call = reactor.callLater(delay, self.retry, spider)
+
+    def batch_done(self) -> None:
+        self.writing = None
+        self.in_flight = 0
+        self.release_waiters()
+
+    def release_waiters(self) -> None:
+        waiters, self.waiters = self.waiters, []
+        for d in waiters:
+            d.callback(None)
+
+    @defer.inlineCallbacks
     def close_spider(self, spider):
-        # Close cursor & connection to database
+        if self.flush_task and self.flush_task.running:
+            self.flush_task.stop()
+        if self.retrying():
+            self.retry_call.cancel()
+        self.closing = True
+
+        # Let the batch on its way finish, then try once more with what's left
+        yield self.wait_for_write()
+        self.flush(spider)
+        yield self.wait_for_write()
+        if self.buffer:
+            self.dump_unsaved(spider)
+        self.index.save()
+        mark_crawl_finished()
+
+        self.pool.stop()
+        # Close cursor & give the connection back
         self.cur.close()
-        self.conn.close()
+        putconn(self.conn)
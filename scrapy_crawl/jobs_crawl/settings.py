@@ -7,6 +7,7 @@
 #     https://docs.scrapy.org/en/latest/topics/downloader-middleware.html
 #     https://docs.scrapy.org/en/latest/topics/spider-middleware.html
 from jobs_crawl.log import PoliteLogFormatter
+from jobs_common.state import STATE_DIR
 
 
 BOT_NAME = "job_crawler"
@@ -24,8 +25,7 @@ LOG_LEVEL = "INFO"
 
 # Configure a delay for requests for the same website (default: 0)
 # See https://docs.scrapy.org/en/latest/topics/settings.html#download-delay
-# See also autothrottle settings and docs
-# DOWNLOAD_DELAY = 1
+# See also the adaptive throttling settings below
 
 # Disable cookies (enabled by default)
 # COOKIES_ENABLED = False
@@ -55,30 +55,70 @@ LOG_LEVEL = "INFO"
 
 # Enable or disable extensions
 # See https://docs.scrapy.org/en/latest/topics/extensions.html
-# EXTENSIONS = {
-#    "scrapy.extensions.telnet.TelnetConsole": None,
-# }
+EXTENSIONS = {
+    "jobs_crawl.extensions.CrawlMetrics": 500,
+}
+
+# Crawl metrics in the Prometheus text format, written to .crawl_state/metrics/METRICS_NAME.prom
+# every METRICS_INTERVAL seconds and when the spider closes. `{spider}` is replaced by the spider name,
+# so `scrapy crawl` processes running at the same time write their own file
+METRICS_ENABLED = True
+METRICS_NAME = "scrapy-{spider}"
+METRICS_INTERVAL = 30
 
 # Configure item pipelines
 # See https://docs.scrapy.org/en/latest/topics/item-pipeline.html
 ITEM_PIPELINES = {
     "jobs_crawl.pipelines.RemoveDuplicatesPipeline": 100,
     "jobs_crawl.pipelines.PostedAtToDatePipeline": 200,
-    "jobs_crawl.pipelines.SavingToSQLPipeline": 300,
+    "jobs_crawl.pipelines.SpoolPipeline": 300,
 }
 
-# Enable and configure the AutoThrottle extension (disabled by default)
-# See https://docs.scrapy.org/en/latest/topics/autothrottle.html
-AUTOTHROTTLE_ENABLED = True
-# The initial download delay
-AUTOTHROTTLE_START_DELAY = 1
-# The maximum download delay to be set in case of high latencies
-AUTOTHROTTLE_MAX_DELAY = 10
-# The average number of requests Scrapy should be sending in parallel to
-# each remote server
-AUTOTHROTTLE_TARGET_CONCURRENCY = 0.5
-# Enable showing throttling stats for every response received:
-AUTOTHROTTLE_DEBUG = False
+# Offers are spooled on disk and loaded into the database when each spider closes, so crawls don't
+# depend on PostgreSQL being up. SavingToSQLPipeline and AsyncSavingToSQLPipeline write to it directly instead
+SPOOL_LOAD_ON_CLOSE = True
+
+# Buffered writes to the database: items are saved as a single multi-row upsert
+# once SQL_BATCH_SIZE items are collected or every SQL_FLUSH_INTERVAL seconds
+SQL_BATCH_SIZE = 100
+SQL_FLUSH_INTERVAL = 5
+# AsyncSavingToSQLPipeline writes from a background thread and holds new items
+# once SQL_MAX_PENDING of them are waiting to be saved
+# (use jobs_crawl.pipelines.SavingToSQLPipeline to write from the reactor thread)
+SQL_MAX_PENDING = 1000
+# Failed batches are retried after SQL_RETRY_DELAY seconds, doubled on each failure. After
+# SQL_MAX_RETRIES failures in a row, pending items are dumped to unsaved_offers_SPIDER.jsonl
+SQL_RETRY_DELAY = 1
+SQL_MAX_RETRIES = 5
+
+# Folder where spiders keep data between runs
+CRAWL_STATE_DIR = str(STATE_DIR)
+
+# Linkedin incremental mode (-a incremental=true): pages requested at once, and share of
+# already stored offers in a page that stops the pagination
+LINKEDIN_PAGE_WINDOW = 3
+LINKEDIN_KNOWN_RATIO = 0.8
+# Extract Linkedin offers as plain dicts with precompiled XPaths instead of item loaders
+# (see benchmarks/linkedin_parse.py)
+LINKEDIN_FAST_PARSING = True
+
+# Adaptive throttling of each domain, replacing the AutoThrottle extension.
+# Domains not seen in previous runs start at DOWNLOAD_DELAY and CONCURRENT_REQUESTS_PER_DOMAIN
+AUTOTHROTTLE_ENABLED = False
+DOWNLOAD_DELAY = 1
+CONCURRENT_REQUESTS_PER_DOMAIN = 1
+DOWNLOADER_MIDDLEWARES = {
+    # Before RetryMiddleware (550) handles the 429 responses
+    "jobs_crawl.middlewares.AdaptiveThrottleMiddleware": 600,
+}
+# Requests per second added on every successful response, until the delay reaches
+# THROTTLE_MIN_DELAY. Concurrency then grows by one every `concurrency` responses
+THROTTLE_RATE_STEP = 0.05
+THROTTLE_MIN_DELAY = 0.25
+THROTTLE_MAX_CONCURRENCY = 8
+# Factor applied to the concurrency and the rate on a 429 response
+THROTTLE_BACKOFF = 0.5
+THROTTLE_MAX_DELAY = 60
 
 RETRY_ENABLED = True
 RETRY_TIMES = 5
@@ -87,11 +127,17 @@ METAREFRESH_ENABLED = False  # Disable MetaRefresh to avoid redirections
 
 # Enable and configure HTTP caching (disabled by default)
 # See https://docs.scrapy.org/en/latest/topics/downloader-middleware.html#httpcache-middleware-settings
-# HTTPCACHE_ENABLED = True
-# HTTPCACHE_EXPIRATION_SECS = 0
-# HTTPCACHE_DIR = "httpcache"
-# HTTPCACHE_IGNORE_HTTP_CODES = []
-# HTTPCACHE_STORAGE = "scrapy.extensions.httpcache.FilesystemCacheStorage"
+HTTPCACHE_ENABLED = True
+# Responses younger than HTTPCACHE_TTL seconds are reused without any request, older ones are
+# revalidated with If-Modified-Since/If-None-Match. Spiders override it in `custom_settings`
+HTTPCACHE_TTL = 3600
+HTTPCACHE_EXPIRATION_SECS = 0
+HTTPCACHE_DIR = str(STATE_DIR / "httpcache")
+# Size in megabytes of the cache of each spider, least recently used responses are evicted
+HTTPCACHE_MAX_SIZE = 200
+HTTPCACHE_IGNORE_HTTP_CODES = [429, 500, 502, 503, 504]
+HTTPCACHE_POLICY = "jobs_crawl.httpcache.TTLPolicy"
+HTTPCACHE_STORAGE = "jobs_crawl.httpcache.SQLiteCacheStorage"
 
 # Set settings whose default value is deprecated to a future-proof value
 REQUEST_FINGERPRINTER_IMPLEMENTATION = "2.7"
@@ -1,39 +1,207 @@
+import json
+from datetime import date
+from pathlib import Path
 from urllib3.util import parse_url
 
 import scrapy
+from lxml import etree
 from scrapy.loader import ItemLoader
 
 from jobs_crawl.items import JobOffer
+from jobs_common.dates import to_dates
+from jobs_common.dedup import load_index, offer_key
+
+
+def has_class(name: str) -> str:
+    """XPath condition matching elements with the given class"""
+    return f"contains(concat(' ', normalize-space(@class), ' '), ' {name} ')"
+
+
+# Same fields as the CSS selectors of `load_offers`, compiled once
+CARDS = etree.XPath("//li")
+FIELDS = {
+    "title": etree.XPath(f".//h3[{has_class('base-search-card__title')}]/text()"),
+    # Companies without a Linkedin profile aren't a link
+    "company": etree.XPath(
+        f".//h4[{has_class('base-search-card__subtitle')}]/a/text()"
+        f" | .//h4[{has_class('base-search-card__subtitle')}][not(a)]/text()"
+    ),
+    "location": etree.XPath(
+        f".//div[{has_class('base-search-card__metadata')}]//span[not(preceding-sibling::*)]/text()"
+    ),
+    "posted_at": etree.XPath(".//time/@datetime"),
+    "url": etree.XPath(".//a[not(preceding-sibling::a)]/@href"),
+}
+
+
+def parse_offers(response) -> list[dict]:
+    """Offers in a page of results as plain dicts, with the same values `load_offers` gives"""
+    offers = []
+    for card in CARDS(response.selector.root):
+        offer = {}
+        for field, xpath in FIELDS.items():
+            # First non empty value, like the `JobOffer` processors
+            value = next((v for v in map(str.strip, xpath(card)) if v), None)
+            if value is not None:
+                offer[field] = value
+        offers.append(offer)
+    return offers
+
+
+def load_offers(response) -> list[JobOffer]:
+    """Offers in a page of results through item loaders"""
+    offers = []
+    for job in response.css("li"):
+        loader = ItemLoader(item=JobOffer(), selector=job)
+
+        loader.add_css("title", "h3.base-search-card__title::text")
+        # Handle the edgecase where company doesn't have a Linkedin profile
+        company = job.css("h4.base-search-card__subtitle a::text").get()
+        if not company:
+            company = job.css("h4.base-search-card__subtitle::text").get()
+        loader.add_value("company", company)
+        loader.add_css(
+            "location", "div.base-search-card__metadata span:first-child::text"
+        )
+        loader.add_css("posted_at", "time::attr(datetime)")
+        loader.add_css("url", "a:first-of-type::attr(href)")
+
+        offers.append(loader.load_item())
+    return offers
 
 
 class LinkedinSpider(scrapy.Spider):
     name = "linkedin_spider"
     allowed_domains = ["linkedin.com"]
 
-    def __init__(self, job: str = None, location: str = "argentina", *args, **kwargs):
+    def __init__(
+        self,
+        job: str = None,
+        location: str = "argentina",
+        incremental: str = "false",
+        *args,
+        **kwargs,
+    ):
         super(LinkedinSpider, self).__init__(*args, **kwargs)
+        self.search = f"{job}|{location}"
+        self.incremental = str(incremental).lower() in ("1", "true", "yes")
 
+        # In incremental mode offers are sorted by date, so known offers are found in the last pages
+        sort = "&sortBy=DD" if self.incremental else ""
         parsed_url = parse_url(
-            f"https://www.linkedin.com/jobs-guest/jobs/api/seeMoreJobPostings/search?keywords={job}&location={location}&geoId=&trk=public_jobs_jobs-search-bar_search-submit&start="
+            f"https://www.linkedin.com/jobs-guest/jobs/api/seeMoreJobPostings/search?keywords={job}&location={location}&geoId=&trk=public_jobs_jobs-search-bar_search-submit{sort}&start="
         )
+        self.base_url = parsed_url.url
         # Linkedin only show 10 offer per page and 1000 is the max limit of offers displayed
         self.start_urls = [parsed_url.url + str(i) for i in range(0, 1000, 10)]
         self.logger.info("Starting url: {}0".format(parsed_url.url))
 
-    def parse(self, response):
-        for job in response.css("li"):
-            loader = ItemLoader(item=JobOffer(), selector=job)
-
-            loader.add_css("title", "h3.base-search-card__title::text")
-            # Handle the edgecase where company doesn't have a Linkedin profile
-            company = job.css("h4.base-search-card__subtitle a::text").get()
-            if not company:
-                company = job.css("h4.base-search-card__subtitle::text").get()
-            loader.add_value("company", company)
-            loader.add_css(
-                "location", "div.base-search-card__metadata span:first-child::text"
-            )
-            loader.add_css("posted_at", "time::attr(datetime)")
-            loader.add_css("url", "a:first-of-type::attr(href)")
+        self.run_date = date.today()
+        self.stop_reason = None
+        self.failed_pages = []
+
+    @classmethod
+    def from_crawler(cls, crawler, *args, **kwargs):
+        spider = super().from_crawler(crawler, *args, **kwargs)
+        spider.page_window = crawler.settings.getint("LINKEDIN_PAGE_WINDOW", 3)
+        spider.known_ratio = crawler.settings.getfloat("LINKEDIN_KNOWN_RATIO", 0.8)
+        spider.state_file = (
+            Path(crawler.settings.get("CRAWL_STATE_DIR")) / f"{spider.name}.json"
+        )
+        last_run = spider.load_state().get(spider.search)
+        spider.last_run = date.fromisoformat(last_run) if last_run else None
+        return spider
+
+    async def start(self):
+        # Scrapy 2.13 and later only call `start`, older versions `start_requests`
+        for request in self.start_requests():
+            yield request
+
+    def start_requests(self):
+        if not self.incremental:
+            for url in self.start_urls:
+                yield scrapy.Request(url, dont_filter=True)
+            return
 
-            yield loader.load_item()
+        # Offers stored before the run, the ones this crawl stores don't tell where the last run stopped
+        self.known = load_index().snapshot()
+        self.logger.info(
+            f"Incremental crawl, last run: {self.last_run}, known offers: {len(self.known)}."
+        )
+
+        # Request a small window of pages, each parsed page schedules the next one
+        for page in range(self.page_window):
+            yield self.page_request(page)
+
+    def page_request(self, page: int) -> scrapy.Request:
+        return scrapy.Request(
+            self.base_url + str(page * 10), cb_kwargs={"page": page}, errback=self.page_failed
+        )
+
+    def page_failed(self, failure):
+        """Keep the chain of pages of a failed request going, its offers are missed in this run"""
+        page = failure.request.cb_kwargs["page"]
+        self.logger.error(f"Page {page} failed: {failure.value!r}.")
+        self.failed_pages.append(page)
+        if not self.stop_reason and (page + self.page_window) * 10 < 1000:
+            yield self.page_request(page + self.page_window)
+
+    def load_state(self) -> dict:
+        """Last successful run date of each search"""
+        if not self.state_file.exists():
+            return {}
+        return json.loads(self.state_file.read_text())
+
+    def parse(self, response, page: int = None):
+        if self.settings.getbool("LINKEDIN_FAST_PARSING"):
+            offers = parse_offers(response)
+        else:
+            offers = load_offers(response)
+
+        # Keep paginating in incremental mode until already known offers are reached. Decided before yielding
+        # the offers, the pipelines change them (`posted_at` becomes a date) and record them as stored
+        stop_reason = None if page is None else self.check_stop(page, offers)
+        yield from offers
+
+        # Another page may have stopped the search in the meantime
+        if page is None or self.stop_reason:
+            return
+        self.stop_reason = stop_reason
+        if self.stop_reason:
+            self.logger.info(f"Stopping pagination at page {page}: {self.stop_reason}.")
+        else:
+            yield self.page_request(page + self.page_window)
+
+    def check_stop(self, page: int, offers: list) -> str | None:
+        """Reason to stop paginating after the given page, if any"""
+        if not offers:
+            return "no more offers"
+        if (page + self.page_window) * 10 >= 1000:
+            return "max limit of offers displayed reached"
+
+        known = sum(
+            offer_key(o.get("title"), o.get("company"), o.get("location")) in self.known
+            for o in offers
+        )
+        if known / len(offers) >= self.known_ratio:
+            return f"{known} out of {len(offers)} offers already stored"
+
+        # Undated offers tell nothing
+        dates = [d for d in to_dates([o.get("posted_at") for o in offers]) if d]
+        if self.last_run and dates and all(d < self.last_run for d in dates):
+            return f"offers posted before the last run ({self.last_run})"
+        return None
+
+    def closed(self, reason):
+        # Only a complete crawl moves the starting point of the next incremental run
+        if not self.incremental or reason != "finished":
+            return
+        if self.failed_pages:
+            self.logger.warning(
+                f"Pages {sorted(self.failed_pages)} failed, the next run starts from {self.last_run} again."
+            )
+            return
+        state = self.load_state()
+        state[self.search] = self.run_date.isoformat()
+        self.state_file.parent.mkdir(parents=True, exist_ok=True)
+        self.state_file.write_text(json.dumps(state, indent=2))
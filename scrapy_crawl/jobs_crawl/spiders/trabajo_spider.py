@@ -9,6 +9,8 @@ from jobs_crawl.items import JobOffer
 class TrabajoSpider(scrapy.Spider):
     name = "trabajo_spider"
     allowed_domains = ["ar.trabajo.org"]
+    # Results are only refreshed a few times a day
+    custom_settings = {"HTTPCACHE_TTL": 3 * 3600}
 
     def __init__(self, job: str = None, *args, **kwargs):
         super(TrabajoSpider, self).__init__(*args, **kwargs)
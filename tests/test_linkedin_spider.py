@@ -0,0 +1,183 @@
+"""
+Incremental Linkedin crawl, with the offers of each page going through the pipelines of the project.
+Usage: python -m unittest discover tests
+"""
+
+import os
+import sys
+import json
+import shutil
+import asyncio
+import tempfile
+import unittest
+from datetime import date, timedelta
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path[:0] = [str(ROOT), str(ROOT / "scrapy_crawl")]
+# The state folder is read when `jobs_common` is imported
+STATE_DIR = tempfile.mkdtemp(prefix="crawl_state_")
+os.environ["CRAWL_STATE_DIR"] = STATE_DIR
+
+import scrapy
+from scrapy.exceptions import DropItem
+from scrapy.http import HtmlResponse
+from scrapy.settings import Settings
+from scrapy.utils.misc import load_object
+from scrapy.utils.reactor import install_reactor, is_reactor_installed
+from scrapy.utils.test import get_crawler
+
+from jobs_common import dedup
+from jobs_crawl.spiders.linkedin_spider import LinkedinSpider
+
+CARD = """
+<li>
+  <a href="https://ar.linkedin.com/jobs/view/{id}">Offer</a>
+  <h3 class="base-search-card__title">Data scientist {id}</h3>
+  <h4 class="base-search-card__subtitle"><a href="#">Company {id}</a></h4>
+  <div class="base-search-card__metadata"><span class="job-search-card__location">Buenos Aires</span></div>
+  <time datetime="{posted_at}">1 day ago</time>
+</li>"""
+
+
+def results_page(spider: LinkedinSpider, page: int, ids: range, posted_at: date) -> HtmlResponse:
+    body = "".join(CARD.format(id=i, posted_at=posted_at.isoformat()) for i in ids)
+    return HtmlResponse(
+        url=spider.page_request(page).url, body=body.encode(), encoding="utf-8"
+    )
+
+
+def project_settings() -> Settings:
+    settings = Settings()
+    settings.setmodule("jobs_crawl.settings")
+    settings.set("METRICS_ENABLED", False)
+    settings.set("SPOOL_LOAD_ON_CLOSE", False)
+    return settings
+
+
+def setUpModule():
+    # Crawlers check the reactor of the settings is the one running
+    if not is_reactor_installed():
+        install_reactor(project_settings()["TWISTED_REACTOR"])
+
+
+def tearDownModule():
+    shutil.rmtree(STATE_DIR, ignore_errors=True)
+
+
+class IncrementalCrawlTest(unittest.TestCase):
+    def setUp(self):
+        # An empty index, so it isn't built from the database
+        for path in Path(STATE_DIR).iterdir():
+            if path.is_file():
+                path.unlink()
+        dedup.DedupIndex().save()
+        # Spiders share the index of the process, each test starts a new one
+        dedup._index = None
+
+        self.crawler = get_crawler(LinkedinSpider, project_settings().copy_to_dict())
+
+    def open_spider(self, last_run: date = None) -> LinkedinSpider:
+        if last_run:
+            state = {"data scientist|argentina": last_run.isoformat()}
+            Path(STATE_DIR, "linkedin_spider.json").write_text(json.dumps(state))
+        spider = LinkedinSpider.from_crawler(
+            self.crawler, job="data scientist", incremental="true"
+        )
+        self.spider = spider
+        self.requests = list(spider.start_requests())
+
+        self.pipelines = []
+        for path, _ in sorted(self.crawler.settings.getdict("ITEM_PIPELINES").items(), key=lambda p: p[1]):
+            cls = load_object(path)
+            pipeline = cls.from_crawler(self.crawler) if hasattr(cls, "from_crawler") else cls()
+            if hasattr(pipeline, "open_spider"):
+                pipeline.open_spider(spider)
+            self.pipelines.append(pipeline)
+        return spider
+
+    def tearDown(self):
+        for pipeline in getattr(self, "pipelines", []):
+            if hasattr(pipeline, "close_spider"):
+                pipeline.close_spider(self.spider)
+
+    def parse(self, spider: LinkedinSpider, response: HtmlResponse, page: int) -> tuple[list, list]:
+        """Items stored and requests scheduled, items go through the pipelines as soon as they're yielded"""
+        items, requests = [], []
+        for output in spider.parse(response, page=page):
+            if isinstance(output, scrapy.Request):
+                requests.append(output)
+                continue
+            try:
+                for pipeline in self.pipelines:
+                    output = pipeline.process_item(output, spider)
+            except DropItem:
+                continue
+            items.append(output)
+        return items, requests
+
+    def test_start(self):
+        spider = self.open_spider()
+
+        async def start_requests():
+            return [request async for request in spider.start()]
+
+        requests = asyncio.run(start_requests())
+        self.assertEqual([r.cb_kwargs["page"] for r in requests], list(range(spider.page_window)))
+
+    def test_closed_saves_last_run(self):
+        spider = LinkedinSpider.from_crawler(self.crawler, job="data scientist", incremental="true")
+        spider.closed("finished")
+        state = json.loads(Path(STATE_DIR, "linkedin_spider.json").read_text())
+        self.assertEqual(state["data scientist|argentina"], date.today().isoformat())
+
+    def test_new_offers_keep_paginating(self):
+        spider = self.open_spider(last_run=date.today() - timedelta(days=7))
+        self.assertEqual(len(self.requests), spider.page_window)
+
+        stored, scheduled = [], []
+        for page in range(spider.page_window):
+            response = results_page(spider, page, range(page * 10, page * 10 + 10), date.today())
+            items, requests = self.parse(spider, response, page)
+            stored += items
+            scheduled += requests
+
+        self.assertEqual(len(stored), 30)
+        # Dates were converted by the pipelines
+        self.assertTrue(all(isinstance(item["posted_at"], date) for item in stored))
+        self.assertIsNone(spider.stop_reason)
+        self.assertEqual(
+            [r.cb_kwargs["page"] for r in scheduled],
+            [page + spider.page_window for page in range(spider.page_window)],
+        )
+
+    def test_offers_stored_during_the_run_keep_paginating(self):
+        spider = self.open_spider()
+        self.parse(spider, results_page(spider, 0, range(10), date.today()), 0)
+        # Results shift as new offers are posted, the next pages show offers of the first ones again
+        items, requests = self.parse(spider, results_page(spider, 3, range(10), date.today()), 3)
+
+        self.assertEqual(items, [])
+        self.assertIsNone(spider.stop_reason)
+        self.assertEqual([r.cb_kwargs["page"] for r in requests], [3 + spider.page_window])
+
+    def test_offers_stored_before_the_run_stop(self):
+        dedup.load_index().add([(f"Data scientist {i}", f"Company {i}", "Buenos Aires") for i in range(10)])
+        spider = self.open_spider()
+        items, requests = self.parse(spider, results_page(spider, 0, range(10), date.today()), 0)
+
+        self.assertEqual(requests, [])
+        self.assertEqual(spider.stop_reason, "10 out of 10 offers already stored")
+
+    def test_offers_before_last_run_stop(self):
+        spider = self.open_spider(last_run=date.today())
+        response = results_page(spider, 0, range(10), date.today() - timedelta(days=2))
+        items, requests = self.parse(spider, response, 0)
+
+        self.assertEqual(len(items), 10)
+        self.assertEqual(requests, [])
+        self.assertIn("before the last run", spider.stop_reason)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,9 +1,16 @@
+import asyncio
 from datetime import datetime
-import os
 
-from pydantic import BaseModel, HttpUrl
 import psycopg2
-from dotenv import load_dotenv
+from pydantic import BaseModel, HttpUrl
+
+from utils import logging
+from jobs_common.dedup import DEDUP_MAX_AGE_DAYS
+from jobs_common.metrics import OFFERS
+from jobs_common.spool import SpoolWriter, drain, offer_row, spool_offers
+
+# Offers of every browser spider of the process go to the same spool segment
+SPOOL = SpoolWriter("zendriver")
 
 
 class Job(BaseModel):
@@ -14,61 +21,28 @@ class Job(BaseModel):
     link: HttpUrl
 
 
-def setup_db():
-    """Connect to the database"""
-    load_dotenv()
-
-    # Database URL
-    PSQL_CONFIG = {
-        "user": os.getenv("PSQL_USER"),
-        "password": os.getenv("PSQL_PASSWORD"),
-        "host": os.getenv("PSQL_HOST"),
-        "dbname": os.getenv("PSQL_DB"),
-    }
-
-    # Connect to my database
-    conn = psycopg2.connect(**PSQL_CONFIG)
-
-    # Create cursor, used to execute commands
-    cur = conn.cursor()
-
-    # Create jobs table if none exists
-    cur.execute(
-        """
-        CREATE TABLE IF NOT EXISTS jobs(
-        id SERIAL PRIMARY KEY,                                       -- Primary key for unique identification
-        viewed BOOLEAN DEFAULT FALSE,                                -- Flag to indicate if the job was applied to (it will be used later)
-        title VARCHAR(255) NOT NULL,                                 -- Job title
-        company VARCHAR(255),                                        -- Company name
-        location VARCHAR(255),                                       -- Job location
-        posted_at DATE,                                              -- Date when the job was posted
-        added_at DATE DEFAULT CURRENT_DATE,                          -- Date when the jobs was added to the database
-        url VARCHAR(2083) NOT NULL,                                  -- URL of the job listing
-        CONSTRAINT job UNIQUE (title, company, location) -- Unique constraint for job identification
-        )"""
-    )
-    conn.commit()
-    return conn, cur
-
-
-def save_to_db(conn, cur, offers) -> None:
-    """Save offers to database"""
-    for offer in offers:
-        cur.execute(
-            """
-            INSERT INTO jobs(title, company, location, posted_at, url) 
-            VALUES (%s, %s, %s, %s, %s)
-            ON CONFLICT (title, company, location) 
-            DO UPDATE SET 
-                added_at = CURRENT_DATE,
-                url = EXCLUDED.url;
-            """,
-            (
-                offer.get("title"),
-                offer.get("company", None),
-                offer.get("location", None),
-                offer.get("posted_at", None),
-                str(offer.get("link")),
-            ),
-        )
-    conn.commit()
+async def save_offers(index, offers, source: str) -> int:
+    """Spool the offers not seen recently, recording them in the crawl metrics. Returns how many were spooled"""
+    new_offers = index.filter_new(offers, DEDUP_MAX_AGE_DAYS)
+    rows = [offer_row(offer, url_field="link") for offer in new_offers]
+    try:
+        if rows:
+            await asyncio.to_thread(spool_offers, SPOOL, rows, source)
+    except Exception:
+        # Let them through when the page is processed again
+        index.forget(new_offers)
+        raise
+    OFFERS.inc(len(new_offers), source=source, outcome="kept")
+    OFFERS.inc(len(offers) - len(new_offers), source=source, outcome="dropped")
+    return len(rows)
+
+
+async def load_spool() -> None:
+    """Load the spool into the database without blocking the event loop, leaving it there if the database is down"""
+    SPOOL.close()
+    try:
+        inserted, updated = await asyncio.to_thread(drain)
+    except psycopg2.Error as e:
+        logging.error(f"Couldn't load the spool into the database, offers stay there for the next run: {e}")
+        return
+    logging.info(f"Spool loaded: {inserted} new offers, {updated} updated.")
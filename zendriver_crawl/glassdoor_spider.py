@@ -1,62 +1,133 @@
-from bs4 import BeautifulSoup
+import json
+import asyncio
+
+from utils import (
+    logging,
+    CHALLENGE_SELECTOR,
+    count_elements,
+    wait_for_change,
+    wait_ready,
+)
+from db_model import save_offers, Job
+from jobs_common.dates import to_dates
+from jobs_common.dedup import load_index
+from jobs_common.metrics import PAGE_SECONDS
+
+# Max number of pages of a search
+MAX_PAGES = 30
+
+# Extract the job cards appended after the first %d ones, as a JSON string.
+# Runs in the page, so only the new cards are read instead of parsing the whole page every time
+NEW_CARDS_SCRIPT = """
+(offset => {
+    const text = el => el ? el.textContent.replace(/\\s+/g, " ").trim() : null;
+    const cards = Array.from(document.querySelectorAll("div.jobCard")).slice(offset);
+    return JSON.stringify(cards.map(card => {
+        const anchor = card.querySelector("a");
+        const divs = card.querySelectorAll("div");
+        return {
+            company: text(card.querySelector("span")),
+            title: text(anchor),
+            location: text(card.querySelector("[id*='job-location']")),
+            posted_at: text(divs[divs.length - 1]),
+            link: anchor ? anchor.href : null,
+        };
+    }));
+})(%d)
+"""
+
+
+def search_url(job: str, page: int = 0) -> str:
+    """Url of a page of results, the first one is the infinite scrolling one"""
+    url = f"https://www.glassdoor.com.ar/Empleo/argentina-{job}-empleos-SRCH_IL.0,9_IN15_KO10,{len(job) + 10}"
+    return f"{url}_IP{page + 1}.htm" if page else f"{url}.htm"
+
+
+def to_offers(cards: list[dict]) -> list[dict]:
+    """Validated offers from the job cards extracted, skipping incomplete ones"""
+    offers = []
+    dates = to_dates([card["posted_at"] for card in cards])
+    for card, posted_at in zip(cards, dates):
+        card["posted_at"] = posted_at
+        if not all(card.values()):
+            logging.warning(f"Skipping incomplete job card: {card}.")
+            continue
+        # Check data type and save
+        end_data = Job(**card).model_dump()
+        offers.append(end_data)
+    return offers
+
+
+async def close_popup(tab) -> None:
+    pop_up = await tab.query_selector("button.CloseButton")
+    if pop_up:
+        logging.info("Getting rid of popup.")
+        await pop_up.click()
+        await wait_for_change(
+            tab, "document.querySelectorAll('button.CloseButton').length", 1, timeout=5
+        )
+
+
+async def scrape_page(tab, job: str, page: int) -> list[dict]:
+    """Offers in a page of results, loaded in the given tab"""
+    await tab.get(search_url(job, page))
+    if not await wait_ready(tab, "div.jobCard"):
+        # A challenge still showing is retried in a new tab, otherwise there are no more results
+        if await count_elements(tab, CHALLENGE_SELECTOR):
+            raise TimeoutError("Challenge not solved.")
+        return []
+    await close_popup(tab)
+    return to_offers(json.loads(await tab.evaluate(NEW_CARDS_SCRIPT % 0)))
 
-from utils import logging, parse_to_date
-from db_model import setup_db, save_to_db, Job
 
 async def glassdoor(browser, job: str) -> None:
     """Scrape job offers from *Glassdoor* website"""
-    logging.info("Connecting to database.")
-    conn, cur = setup_db()
+    index = await asyncio.to_thread(load_index)
 
     logging.info("Requesting Glassdoor.")
-    url = f"https://www.glassdoor.com.ar/Empleo/argentina-{job}-empleos-SRCH_IL.0,9_IN15_KO10,{len(job) + 10}.htm"
+    url = search_url(job)
     logging.info(f"Starting at {url}.")
-    glassdoor = await browser.get(url)
-    await glassdoor.sleep(
-        10
-    )  # Add time to manually click the cloudfare captcha if it appears (only in headless mode disabled)
+    with PAGE_SECONDS.time(source="glassdoor"):
+        glassdoor = await browser.get(url, new_tab=True)
+        ready = await wait_ready(glassdoor, "div.jobCard")
+    if not ready:
+        await glassdoor.close()
+        return
 
     # Infinite scrolling to load more content dinamically while closing the popup if it appears
+    cards_number = 0
     offers_number = 0
+    spooled_number = 0
     while True:
-        await glassdoor.wait(10)
-        pop_up = await glassdoor.query_selector("button.CloseButton")
-        if pop_up:
-            logging.info("Getting rid of popup.")
-            await pop_up.click()
-            await glassdoor.wait(5)
-
-        # Get content and parse it with BeautifulSoup
-        source_html = await glassdoor.get_content()
-        soup = BeautifulSoup(source_html, "html.parser")
-        elems = soup.select("div.jobCard")
-        offers = []
-        for elem in elems[offers_number:]:
-            anchor = elem.select_one("a")
-            span = elem.select_one("span")
-            location = elem.select_one("[id*='job-location']")
-            date = elem.select("div")
-            data = {
-                "company": span.get_text(strip=True),
-                "title": anchor.get_text(strip=True),
-                "location": location.get_text(strip=True),
-                "posted_at": parse_to_date(date[-1].get_text(strip=True)).date(),
-                "link": anchor["href"],
-            }
-            # Check data type and save
-            end_data = Job(**data).model_dump()
-            offers.append(end_data)
-
-        # Save to database
-        save_to_db(conn, cur, offers)
+        await close_popup(glassdoor)
+
+        # Get only the cards loaded since the last iteration
+        cards = json.loads(await glassdoor.evaluate(NEW_CARDS_SCRIPT % cards_number))
+        cards_number += len(cards)
+        offers = to_offers(cards)
+
         offers_number += len(offers)
         logging.info(f"Offers scraped: {offers_number}.")
 
+        # Save the ones not seen recently
+        spooled = await save_offers(index, offers, "glassdoor")
+        spooled_number += spooled
+        logging.info(f"Offers saved: {spooled} ({spooled_number} in total).")
+
         # Load more content
         next_button = await glassdoor.query_selector("button[data-test='load-more']")
         if not next_button:
             logging.info("Finished.")
             break
         await next_button.click()
+        # Wait for the new cards to be appended
+        with PAGE_SECONDS.time(source="glassdoor"):
+            loaded = await wait_for_change(
+                glassdoor, "document.querySelectorAll('div.jobCard').length", cards_number, timeout=30
+            )
+        if not loaded:
+            logging.warning("No more cards loaded, finishing.")
+            break
 
     logging.info("Closing spider.")
+    await glassdoor.close()
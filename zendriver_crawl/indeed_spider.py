@@ -1,72 +1,194 @@
-import re
 import json
+import time
+import asyncio
 from datetime import datetime, UTC
+from urllib.parse import urlsplit, urlunsplit, parse_qs, urlencode
 
 from glom import glom
 
-from utils import logging
-from db_model import setup_db, save_to_db, Job
+from utils import logging, CHALLENGE_SELECTOR, count_elements, wait_ready
+from db_model import save_offers, Job
+from jobs_common.dedup import load_index
+from jobs_common.metrics import PAGE_SECONDS
+
+# Job cards are embedded in the page as the json assigned to this variable
+JOB_CARDS_MARKER = 'window.mosaic.providerData["mosaic-provider-jobcards"]='
+
+# Pages requested at the same time, and max number of pages of a search
+PARALLEL_PAGES = 5
+MAX_PAGES = 100
+# Times a page is requested before loading it in the tab, and seconds waited before each retry (times the attempt)
+FETCH_ATTEMPTS = 3
+RETRY_DELAY = 5
+
+# Request pages from the browser, so the session cookies are sent, keeping only the script with the job cards.
+# Expects the list of urls and the marker, returns a JSON list with the status and the text of each page.
+# The text is empty if the request failed (status 0) or the page has no job cards (e.g. a challenge)
+FETCH_PAGES_SCRIPT = """
+Promise.all(%s.map(url =>
+    fetch(url, {credentials: "include"})
+        .then(response => response.text().then(html => {
+            const start = response.ok ? html.indexOf(%s) : -1;
+            const text = start === -1 ? "" : html.slice(start, html.indexOf("</script>", start));
+            return {status: response.status, text: text};
+        }))
+        .catch(() => ({status: 0, text: ""}))
+)).then(JSON.stringify)
+"""
+
+
+def parse_job_cards(text: str) -> list[dict]:
+    """Job cards embedded in the text of a page"""
+    start = text.find(JOB_CARDS_MARKER)
+    if start == -1:
+        return []
+    # Decode just the json object following the marker, ignoring the rest of the script
+    json_data, _ = json.JSONDecoder().raw_decode(text, start + len(JOB_CARDS_MARKER))
+    return glom(json_data, "metaData.mosaicProviderJobCardsModel.results", default=[])
+
+
+def page_url(next_url: str, page: int) -> str:
+    """Url of a page of results, from the url of the second one"""
+    parts = urlsplit(next_url)
+    query = parse_qs(parts.query)
+    query["start"] = [str(page * 10)]
+    return urlunsplit(parts._replace(query=urlencode(query, doseq=True)))
+
+
+def search_url(job: str, page: int = 0) -> str:
+    """Url of a page of results"""
+    url = f"https://ar.indeed.com/q-{job}-l-argentina-empleos.html"
+    return f"{url}?start={page * 10}" if page else url
+
+
+def to_offer(result: dict) -> dict:
+    """Validated offer from a job card"""
+    data = {
+        "company": result["company"],
+        "title": result["displayTitle"],
+        "location": result["formattedLocation"],
+        "posted_at": datetime.fromtimestamp(result["createDate"] / 1000, UTC).date(),
+        "link": "https://ar.indeed.com" + result["link"],
+    }
+    # Check data type and save
+    return Job(**data).model_dump()
+
+
+async def fetch_pages(tab, urls: list[str]) -> list[str | None]:
+    """
+    Script with the job cards of each page, requested in parallel. Failed pages are requested again,
+    and loaded in the tab as a last resort (a challenge can be solved there). None for the pages still failing.
+    """
+    texts = dict.fromkeys(urls)
+    pending = urls
+    for attempt in range(FETCH_ATTEMPTS):
+        if attempt:
+            await asyncio.sleep(RETRY_DELAY * attempt)
+        pages = json.loads(
+            await tab.evaluate(
+                FETCH_PAGES_SCRIPT % (json.dumps(pending), json.dumps(JOB_CARDS_MARKER)),
+                await_promise=True,
+            )
+        )
+        failed = []
+        for url, page in zip(pending, pages):
+            if page["text"]:
+                texts[url] = page["text"]
+            else:
+                logging.warning(f"Couldn't fetch {url} (status {page['status']}).")
+                failed.append(url)
+        pending = failed
+        if not pending:
+            break
+
+    for url in pending:
+        logging.info(f"Loading {url} in the tab.")
+        await tab.get(url)
+        if await wait_ready(tab, "script#mosaic-data", timeout=60):
+            texts[url] = await tab.evaluate(
+                "document.querySelector('script#mosaic-data').textContent"
+            )
+        else:
+            logging.error(f"Giving up on {url}.")
+    return list(texts.values())
+
+
+async def scrape_page(tab, job: str, page: int) -> list[dict]:
+    """Offers in a page of results, loaded in the given tab"""
+    await tab.get(search_url(job, page))
+    if not await wait_ready(tab, "script#mosaic-data", timeout=60):
+        # A challenge still showing is retried in a new tab, otherwise there are no more results
+        if await count_elements(tab, CHALLENGE_SELECTOR):
+            raise TimeoutError("Challenge not solved.")
+        return []
+    results = parse_job_cards(
+        await tab.evaluate("document.querySelector('script#mosaic-data').textContent")
+    )
+    return [to_offer(r) for r in results]
+
 
 async def indeed(browser, job: str) -> None:
     """Scrape data from *Indeed* website"""
-    logging.info("Connecting to database.")
-    conn, cur = setup_db()
+    index = await asyncio.to_thread(load_index)
 
     logging.info("Requesting Indeed.")
     # Indeed page
-    url = f"https://ar.indeed.com/q-{job}-l-argentina-empleos.html"
+    url = search_url(job)
     logging.info(f"Starting at {url}.")
-    indeed = await browser.get(url, new_tab=True)
-    await indeed.sleep(
-        15
-    )  # Add time to manually click the cloudfare captcha if it appears (only in headless mode disabled)
+    # The first page is rendered, it also sets up the session used to request the next ones
+    with PAGE_SECONDS.time(source="indeed"):
+        indeed = await browser.get(url, new_tab=True)
+        ready = await wait_ready(indeed, "script#mosaic-data", timeout=60)
+    if not ready:
+        await indeed.close()
+        return
+    results = parse_job_cards(
+        await indeed.evaluate("document.querySelector('script#mosaic-data').textContent")
+    )
+    next_url = await indeed.evaluate(
+        "document.querySelector(\"a[data-testid='pagination-page-next']\")?.href || ''"
+    )
 
-    # Paginate while scraping jobs data
+    # Request the next pages in parallel until they only repeat known job cards
+    page = 1
+    jobs_seen = set()
     offers_number = 0
+    spooled_number = 0
     while True:
-        await indeed.wait(10)
-        try:
-            # Look for the json data
-            elem = await indeed.wait_for("script#mosaic-data", timeout=60)
-        except TimeoutError:
-            logging.warning("Timeout reached looking for json data.")
-            break
-
-        # Get json data
-        elem_html = await elem.get_html()
-        pattern = (
-            r'window\.mosaic\.providerData\["mosaic-provider-jobcards"\]=(\{.*?\});'
-        )
-        str_json = re.search(pattern, elem_html, re.DOTALL)
-        if not str_json:
-            continue
-        json_data = json.loads(str_json.group(1))
-        results = glom(json_data, "metaData.mosaicProviderJobCardsModel.results")
         offers = []
         for r in results:
-            data = {
-                "company": r["company"],
-                "title": r["displayTitle"],
-                "location": r["formattedLocation"],
-                "posted_at": datetime.fromtimestamp(r["createDate"] / 1000, UTC).date(),
-                "link": "https://ar.indeed.com" + r["link"],
-            }
-            # Check data type and save
-            end_data = Job(**data).model_dump()
-            offers.append(end_data)
-
-        # Save to database
-        save_to_db(conn, cur, offers)
+            if r["jobkey"] in jobs_seen:
+                continue
+            jobs_seen.add(r["jobkey"])
+            offers.append(to_offer(r))
+        if not offers:
+            logging.info("Finished.")
+            break
+
         offers_number += len(offers)
         logging.info(f"Offers scraped: {offers_number}.")
 
-        # Next page
-        next_button = await indeed.query_selector(
-            "a[data-testid='pagination-page-next']"
-        )
-        if not next_button:
+        # Save the ones not seen recently
+        spooled = await save_offers(index, offers, "indeed")
+        spooled_number += spooled
+        logging.info(f"Offers saved: {spooled} ({spooled_number} in total).")
+
+        # Next pages
+        if not next_url or page >= MAX_PAGES:
             logging.info("Finished.")
             break
-        await next_button.click()
+        urls = [page_url(next_url, p) for p in range(page, min(page + PARALLEL_PAGES, MAX_PAGES))]
+        # Pages are fetched at once, each one is recorded as taking the time of the whole window
+        start = time.perf_counter()
+        texts = await fetch_pages(indeed, urls)
+        for _ in urls:
+            PAGE_SECONDS.observe(time.perf_counter() - start, source="indeed")
+        results = [r for text in texts if text for r in parse_job_cards(text)]
+        # Blocked pages aren't the end of the results
+        if not results and None in texts:
+            logging.error(f"Stopping, pages {page} to {page + len(urls) - 1} couldn't be loaded.")
+            break
+        page += len(urls)
 
     logging.info("Closing spider.")
+    await indeed.close()
@@ -3,18 +3,65 @@ import argparse
 
 import zendriver as zd
 
-from utils import logging
+from utils import logging, timed
+import glassdoor_spider
+import indeed_spider
 from glassdoor_spider import glassdoor
 from indeed_spider import indeed
+from tab_pool import Source, TabPool
+from db_model import load_spool
+from jobs_common.dedup import load_index
+from jobs_common.metrics import write_metrics
+from jobs_common.state import mark_crawl_finished
 
-async def main(job: str) -> None:
-    """Run the spiders asynchronously."""
-    browser = await zd.start(
+SOURCES = {"glassdoor": glassdoor, "indeed": indeed}
+
+# Same sources, scraped page by page by a pool of tabs
+PAGE_SOURCES = {
+    "glassdoor": Source(glassdoor_spider.scrape_page, "glassdoor.com.ar", glassdoor_spider.MAX_PAGES),
+    "indeed": Source(indeed_spider.scrape_page, "ar.indeed.com", indeed_spider.MAX_PAGES),
+}
+
+
+async def start_browser():
+    return await zd.start(
         headless=False
     )  # Enable headless mode if the website doesn't block you
-    job = job.replace(" ", "-")
-    await asyncio.gather(glassdoor(browser, job), indeed(browser, job))
+
+
+def spider_runs(
+    browser, jobs: list[str], timings: dict, semaphore, tabs: int = 0, max_per_domain: int = 2
+) -> list:
+    """
+    Coroutines running every spider for every job search, each one in its own tab.
+    With `tabs` set, a single pool with that many tabs per site scrapes the pages of every search instead.
+    """
+    if tabs:
+        pool = TabPool(browser, PAGE_SOURCES, tabs, max_per_domain)
+        queries = [job.replace(" ", "-") for job in jobs]
+        return [timed("tab pool", pool.run(queries, timings), timings, semaphore)]
+    return [
+        timed(f"{name} ({job})", spider(browser, job.replace(" ", "-")), timings, semaphore)
+        for job in jobs
+        for name, spider in SOURCES.items()
+    ]
+
+
+async def main(jobs: list[str], concurrency: int = 2, tabs: int = 0, max_per_domain: int = 2) -> None:
+    """Run the spiders asynchronously, at most `concurrency` of them at the same time."""
+    timings = {}
+    browser = await start_browser()
+    semaphore = asyncio.Semaphore(concurrency)
+    await asyncio.gather(*spider_runs(browser, jobs, timings, semaphore, tabs, max_per_domain))
     await browser.stop()
+    # Share the offers saved with the next runs and the other crawlers
+    load_index().save()
+    await load_spool()
+    mark_crawl_finished()
+    write_metrics("zendriver")
+
+    for name, seconds in timings.items():
+        logging.info(f"{name} took {seconds:.1f}s.")
 
 
 if __name__ == "__main__":
@@ -22,11 +69,20 @@ if __name__ == "__main__":
         description="Run the spiders scraping for jobs in each web site through an automated browser. Location is set to Argentina."
     )
     parser.add_argument(
-        "-s", "--search", type=str, required= True, help="Job search keyword"
+        "-s", "--search", type=str, nargs="+", required= True, help="Job search keywords"
+    )
+    parser.add_argument(
+        "-c", "--concurrency", type=int, default=2, help="Max number of spiders running at the same time"
+    )
+    parser.add_argument(
+        "-t", "--tabs", type=int, default=0, help="Tabs per site scraping pages in parallel (0 runs one spider per search)"
+    )
+    parser.add_argument(
+        "-p", "--per-domain", type=int, default=2, help="Max number of pages of the same site loading at the same time"
     )
     args = parser.parse_args()
-    job = args.search
+    jobs = args.search
 
     logging.info("Running Program ...")
-    logging.info(f"Looking for {job} in Argentina.")
-    zd.loop().run_until_complete(main(job))
+    logging.info(f"Looking for {', '.join(jobs)} in Argentina.")
+    zd.loop().run_until_complete(main(jobs, args.concurrency, args.tabs, args.per_domain))
@@ -0,0 +1,172 @@
+import time
+import asyncio
+from dataclasses import dataclass
+from typing import Awaitable, Callable
+
+from utils import logging
+from db_model import save_offers
+from jobs_common.dedup import load_index, offer_key
+from jobs_common.metrics import PAGE_SECONDS
+
+
+@dataclass
+class Source:
+    """Web site scraped page by page: `scrape_page(tab, query, page)` returns the offers in a page of results"""
+
+    scrape_page: Callable[..., Awaitable[list[dict]]]
+    domain: str
+    max_pages: int
+
+
+class EmptyPage(Exception):
+    """A page without offers, the site may be blocking the tab or the page didn't render"""
+
+
+class SaveError(Exception):
+    """The offers of a page couldn't be saved"""
+
+
+@dataclass
+class Task:
+    source: str
+    query: str
+    page: int
+    attempts: int = 0
+
+
+class TabPool:
+    """
+    Tabs of a browser scraping pages of results from a queue of (source, query, page) tasks.
+    Each source gets `tabs_per_site` tabs, and at most `max_per_domain` pages of the same domain load at a time.
+    A search keeps scheduling its next pages while they bring offers not scraped before.
+    A failing tab (or one loading an empty page) is replaced by a new one and its task is retried,
+    up to `max_attempts` times. Pages whose offers couldn't be saved are retried in the same tab.
+    """
+
+    def __init__(
+        self,
+        browser,
+        sources: dict[str, Source],
+        tabs_per_site: int = 2,
+        max_per_domain: int = 2,
+        max_attempts: int = 3,
+    ):
+        self.browser = browser
+        self.sources = sources
+        self.tabs_per_site = tabs_per_site
+        self.max_attempts = max_attempts
+        self.queues = {name: asyncio.Queue() for name in sources}
+        self.domains = {
+            source.domain: asyncio.Semaphore(max_per_domain) for source in sources.values()
+        }
+        self.seen = {}  # (source, query) -> keys of the offers scraped
+        self.done = set()  # Searches without more pages to scrape
+        self.tabs = {}  # (source, number) -> tab
+
+    async def run(self, queries: list[str], timings: dict) -> None:
+        """Scrape every source for every query, recording when each search finished"""
+        self.index = await asyncio.to_thread(load_index)
+        self.timings = timings
+        self.started = time.perf_counter()
+
+        # Every tab of a site starts on a different page, then walks `tabs_per_site` pages ahead
+        for name in self.sources:
+            for query in queries:
+                self.seen[(name, query)] = set()
+                for page in range(self.tabs_per_site):
+                    self.queues[name].put_nowait(Task(name, query, page))
+
+        workers = [
+            asyncio.create_task(self.worker(name, number))
+            for name in self.sources
+            for number in range(self.tabs_per_site)
+        ]
+        await asyncio.gather(*(queue.join() for queue in self.queues.values()))
+        for worker in workers:
+            worker.cancel()
+        await asyncio.gather(*workers, return_exceptions=True)
+        for tab in self.tabs.values():
+            await self.discard_tab(tab)
+
+    async def worker(self, name: str, number: int) -> None:
+        source = self.sources[name]
+        queue = self.queues[name]
+        while True:
+            task = await queue.get()
+            try:
+                if (task.source, task.query) in self.done:
+                    continue
+                if self.tabs.get((name, number)) is None:
+                    self.tabs[(name, number)] = await self.browser.get("about:blank", new_tab=True)
+                await self.scrape(self.tabs[(name, number)], source, task)
+            except SaveError:
+                logging.exception(f"{name} couldn't save page {task.page} of {task.query}.")
+                # The tab is fine, the page is scraped again and its offers saved then
+                self.retry(task)
+            except Exception as e:
+                if isinstance(e, EmptyPage):
+                    logging.warning(f"{name} tab {number} loaded page {task.page} of {task.query} empty.")
+                else:
+                    logging.exception(f"{name} tab {number} failed on page {task.page} of {task.query}.")
+                # The tab may be stuck on a challenge, a popup or crashed, start over with a new one
+                self.tabs[(name, number)] = await self.discard_tab(self.tabs.get((name, number)))
+                self.retry(task, ended=isinstance(e, EmptyPage))
+            finally:
+                queue.task_done()
+
+    async def scrape(self, tab, source: Source, task: Task) -> None:
+        async with self.domains[source.domain]:
+            with PAGE_SECONDS.time(source=task.source):
+                offers = await source.scrape_page(tab, task.query, task.page)
+
+        if not offers:
+            raise EmptyPage()
+
+        search = (task.source, task.query)
+        name = f"{task.source} ({task.query})"
+        self.timings[name] = time.perf_counter() - self.started
+        keys = {offer_key(o["title"], o["company"], o["location"]) for o in offers}
+        # Past the last page, sites repeat it
+        if not keys - self.seen[search]:
+            self.finish(task)
+            return
+
+        # Save the ones not seen recently
+        try:
+            spooled = await save_offers(self.index, offers, task.source)
+        except Exception as e:
+            raise SaveError() from e
+        # Only once saved, otherwise a retry would find nothing new and end the search
+        self.seen[search] |= keys
+        logging.info(f"{name} page {task.page}: {len(offers)} offers scraped, {spooled} saved.")
+
+        next_page = task.page + self.tabs_per_site
+        if next_page < source.max_pages:
+            self.queues[task.source].put_nowait(Task(task.source, task.query, next_page))
+
+    def finish(self, task: Task) -> None:
+        search = (task.source, task.query)
+        if search not in self.done:
+            logging.info(f"{task.source} ({task.query}) finished at page {task.page}.")
+            self.done.add(search)
+
+    def retry(self, task: Task, ended: bool = False) -> None:
+        """Queue the task again. With `ended`, a task out of attempts is taken as the end of the search."""
+        if task.attempts + 1 >= self.max_attempts:
+            if ended:
+                self.finish(task)
+                return
+            logging.error(f"Giving up on page {task.page} of {task.source} ({task.query}).")
+            return
+        task.attempts += 1
+        self.queues[task.source].put_nowait(task)
+
+    async def discard_tab(self, tab) -> None:
+        """Close the tab if it's still alive"""
+        if tab is None:
+            return None
+        try:
+            await tab.close()
+        except Exception:
+            pass
+        return None
@@ -1,32 +1,80 @@
+import sys
+import json
+import time
+import asyncio
+import contextlib
 import logging
-from datetime import datetime, timedelta
-import re
+from pathlib import Path
+
+# Make the modules shared with the other crawlers importable
+sys.path.append(str(Path(__file__).resolve().parents[1]))
 
 logging.basicConfig(
     level=logging.INFO,
     format="%(asctime)s - %(funcName)s - %(levelname)s - %(message)s",
 )
 
-def parse_to_date(timedelta_str: str) -> datetime:
-    """Parse timedelta string to `datetime`."""
-    # Extract numbers and units using regex
-    pattern = r"(\d+)\s*(d|h|m|s)"
-    match = re.search(pattern, timedelta_str)
-
-    # Initialize a timedelta
-    delta = timedelta()
-
-    # Map extracted values to timedelta
-    value, unit = match.group(1), match.group(2)
-    value = int(value)
-    if unit == "d":
-        delta += timedelta(days=value)
-    elif unit == "h":
-        delta += timedelta(hours=value)
-    elif unit == "m":
-        delta += timedelta(minutes=value)
-    elif unit == "s":
-        delta += timedelta(seconds=value)
-
-    # Get timestamp
-    return datetime.now() - delta
\ No newline at end of file
+async def timed(name: str, coro, timings: dict, semaphore=None) -> None:
+    """
+    Await a spider, recording its duration. A failing spider is logged without stopping the others.
+    If a semaphore is given, the spider waits for a free slot before starting.
+    """
+    if semaphore is None:
+        semaphore = contextlib.nullcontext()
+    async with semaphore:
+        start = time.perf_counter()
+        try:
+            await coro
+        except Exception:
+            logging.exception(f"{name} failed.")
+        finally:
+            timings[name] = time.perf_counter() - start
+
+
+# Elements shown by Cloudflare while checking the browser
+CHALLENGE_SELECTOR = "#challenge-form, #challenge-running, #challenge-stage, iframe[src*='challenges.cloudflare.com']"
+# Time given to manually solve a challenge (only in headless mode disabled)
+CHALLENGE_GRACE = 60
+# Time between checks of the page state
+POLL_INTERVAL = 0.25
+
+
+async def count_elements(tab, selector: str) -> int:
+    """Number of elements in the page matching the selector"""
+    try:
+        return await tab.evaluate(f"document.querySelectorAll({json.dumps(selector)}).length")
+    except Exception:
+        # The page is navigating, its document isn't available yet
+        return 0
+
+
+async def wait_for_change(tab, expression: str, previous, timeout: float) -> bool:
+    """Wait until the JS expression evaluates to something else than `previous`"""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            if await tab.evaluate(expression) != previous:
+                return True
+        except Exception:
+            pass  # The page is navigating, its document isn't available yet
+        await asyncio.sleep(POLL_INTERVAL)
+    return False
+
+
+async def wait_ready(tab, selector: str, timeout: float = 30) -> bool:
+    """
+    Wait until an element matching the selector is in the page.
+    If a challenge page shows up instead, give it `CHALLENGE_GRACE` extra seconds to be solved.
+    """
+    deadline = time.monotonic() + timeout
+    challenged = False
+    while time.monotonic() < deadline:
+        if await count_elements(tab, selector):
+            return True
+        if not challenged and await count_elements(tab, CHALLENGE_SELECTOR):
+            logging.warning(f"Challenge detected, waiting up to {CHALLENGE_GRACE}s to be solved.")
+            challenged = True
+            deadline += CHALLENGE_GRACE
+        await asyncio.sleep(POLL_INTERVAL)
+    logging.warning(f"Timeout reached waiting for {selector}.")
+    return False